@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2007 David JL <izimobil@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# $Id$
+
+"""
+Action discovery benchmark.
+
+Installs N copies of the audio_converter action in a fake home directory
+and times ActionManager.get_all(), sequentially and with a pool of workers,
+with a cold registry index (every action.xml file is parsed) and with a warm
+one (action.xml files are only stat'ed).
+Discovery is bound by the round trips to the filesystem, so unless --latency
+is 0 every open, stat and listdir is delayed by the given latency, like on a
+network filesystem. Use --latency 0 and --dir with a real NFS mount to
+measure the actual filesystem.
+"""
+
+__version__ = '$Revision$'
+__author__  = 'David JEAN LOUIS <izimobil@gmail.com>'
+
+# dependencies {{{
+
+import os
+import sys
+import time
+import __builtin__
+import shutil
+import tempfile
+import optparse
+
+cur_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(cur_dir, '..'))
+
+# }}}
+# setup_home() {{{
+
+def setup_home(basedir, count):
+    """
+    Create a fake home directory containing 'count' user actions.
+    """
+    from gautomator.core import settings
+    home = tempfile.mkdtemp(prefix='gautomator-bench-', dir=basedir)
+    os.environ['HOME'] = home
+    src = os.path.join(settings.get_builtin_actions_dir(), 'audio_converter')
+    actions_dir = settings.get_user_actions_dir()
+    os.makedirs(actions_dir)
+    xml = open(os.path.join(src, 'action.xml')).read()
+    for i in range(count):
+        action_id = 'bench_action_%05d' % i
+        d = os.path.join(actions_dir, action_id)
+        os.mkdir(d)
+        fh = open(os.path.join(d, 'action.xml'), 'w')
+        fh.write(xml.replace('"audio_converter"', '"%s"' % action_id))
+        fh.close()
+        shutil.copy(os.path.join(src, '__init__.py'), d)
+    return home
+
+# }}}
+# set_latency() {{{
+
+_originals = (__builtin__.open, os.stat, os.listdir)
+
+def set_latency(latency):
+    """
+    Delay every open, stat and listdir call by 'latency' seconds, or restore
+    the original functions if latency is 0.
+    """
+    def delayed(func):
+        def wrapper(*args, **kwargs):
+            time.sleep(latency)
+            return func(*args, **kwargs)
+        return wrapper
+    if latency:
+        funcs = [delayed(f) for f in _originals]
+    else:
+        funcs = _originals
+    __builtin__.open, os.stat, os.listdir = funcs
+
+# }}}
+# timeit() {{{
+
+def timeit(workers, repeat, cold, latency):
+    """
+    Return the best time of 'repeat' get_all() calls, with or without the
+    registry index.
+    """
+    from gautomator.core import settings
+    from gautomator.core.controllers import ActionManager
+    index = settings.get_action_registry_filepath()
+    if not cold:
+        ActionManager.get_all(force_reload=True)
+    best = None
+    for i in range(repeat):
+        if cold and os.path.exists(index):
+            os.unlink(index)
+        set_latency(latency)
+        try:
+            start = time.time()
+            ActionManager.get_all(force_reload=True, workers=workers)
+            elapsed = time.time() - start
+        finally:
+            set_latency(0)
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+# }}}
+# main() {{{
+
+def main():
+    parser = optparse.OptionParser()
+    parser.usage = '%prog [options]'
+    parser.add_option('-n', '--counts', dest='counts', default='100,1000',
+        help='comma separated numbers of actions to benchmark')
+    parser.add_option('-w', '--workers', dest='workers', type='int',
+        default=8, help='number of workers of the parallel run')
+    parser.add_option('-r', '--repeat', dest='repeat', type='int',
+        default=3, help='number of runs, the best time is reported')
+    parser.add_option('-d', '--dir', dest='dir', default=None,
+        help='directory where the fake home is created')
+    parser.add_option('-l', '--latency', dest='latency', type='float',
+        default=1.0, help='simulated filesystem latency in milliseconds '
+        '(default: 1.0, 0 to disable)')
+    (options, args) = parser.parse_args()
+    latency = options.latency / 1000.0
+    print '%8s %6s %12s %12s %8s' % ('actions', 'index', 'sequential',
+                                     'parallel', 'speedup')
+    for count in [int(c) for c in options.counts.split(',')]:
+        home = setup_home(options.dir, count)
+        try:
+            for cold in (True, False):
+                seq = timeit(0, options.repeat, cold, latency)
+                par = timeit(options.workers, options.repeat, cold, latency)
+                print '%8d %6s %11.3fs %11.3fs %7.2fx' % (count,
+                    cold and 'cold' or 'warm', seq, par, seq / par)
+        finally:
+            shutil.rmtree(home)
+
+# }}}
+
+if __name__ == '__main__':
+    main()
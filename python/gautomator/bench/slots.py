@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2007 David JL <izimobil@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# $Id$
+
+
+"""
+Scheduler slots regression check.
+
+Runs an item parallel action through engine.stream() with a scheduler, for
+every combination of resource limit, result order and outcome: success, an
+item raising an exception, a result that cannot be sent back by the worker
+(it cannot be pickled) and a consumer that stops early. Each run must end,
+raise the error of the item when there is one, and give back every slot it
+took. The exit status is 1 if a run hangs or leaks slots.
+"""
+
+__version__ = '$Revision$'
+__author__  = 'David JEAN LOUIS <izimobil@gmail.com>'
+
+# dependencies {{{
+
+import os
+import sys
+import time
+import threading
+import itertools
+import optparse
+
+cur_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(cur_dir, '..'))
+
+# }}}
+# class BenchAction {{{
+
+class BenchAction:
+    """
+    Item parallel action, 'error' items raise an exception and 'unpicklable'
+    items produce a result that cannot be sent back to the parent process.
+    """
+
+    def __init__(self, ordered):
+        self.info = {'id': 'bench_action', 'version': '0.1.0',
+                     'parallel': True, 'ordered': ordered}
+
+    def run(self, item):
+        if item == 'error':
+            raise ValueError('error item')
+        elif item == 'unpicklable':
+            yield threading.Lock()
+        else:
+            time.sleep(0.01)
+            yield item
+
+# }}}
+# constants {{{
+
+# (case name, input items, number of results consumed or None for all,
+# the run must raise an exception)
+CASES = [
+    ('success', range(8), None, False),
+    ('error', [0, 1, 'error', 2, 3, 4], None, True),
+    ('unpicklable', [0, 'unpicklable', 1, 2, 3, 4], None, True),
+    ('closed', range(8), 2, False),
+]
+
+# }}}
+# check() {{{
+
+def check(limit, ordered, items, count, fails, timeout):
+    """
+    Run a case and return a (status, elapsed time) tuple, where status is
+    'ok', 'hang', 'leak' or 'wrong' if the run did not fail as expected.
+    """
+    from gautomator.core import engine, scheduler
+    sched = scheduler.Scheduler({'cpu': limit})
+    steps = [(BenchAction(ordered), {})]
+    failed = []
+    def run():
+        try:
+            results = engine.stream(steps, items, workers=2, scheduler=sched)
+            list(itertools.islice(results, count))
+            results.close()
+        except Exception, exc:
+            failed.append(exc)
+    start = time.time()
+    t = threading.Thread(target=run)
+    t.setDaemon(True)
+    t.start()
+    t.join(timeout)
+    elapsed = time.time() - start
+    if t.isAlive():
+        return ('hang', elapsed)
+    if sched.running['cpu']:
+        return ('leak', elapsed)
+    if bool(failed) != fails:
+        return ('wrong', elapsed)
+    return ('ok', elapsed)
+
+# }}}
+# main() {{{
+
+def main():
+    parser = optparse.OptionParser()
+    parser.usage = '%prog [options]'
+    parser.add_option('-l', '--limits', dest='limits', default='1,2',
+        help='comma separated cpu limits to check')
+    parser.add_option('-t', '--timeout', dest='timeout', type='float',
+        default=10.0, help='seconds after which a run is considered hung')
+    (options, args) = parser.parse_args()
+    status = 0
+    print '%6s %9s %12s %8s %6s' % ('limit', 'order', 'case', 'time',
+                                    'status')
+    for limit in [int(l) for l in options.limits.split(',')]:
+        for ordered in (True, False):
+            for name, items, count, fails in CASES:
+                ret, elapsed = check(limit, ordered, items, count, fails,
+                                     options.timeout)
+                print '%6d %9s %12s %7.2fs %6s' % (limit,
+                    ordered and 'ordered' or 'unordered', name, elapsed, ret)
+                if ret != 'ok':
+                    status = 1
+    if status:
+        # hung runs still hold their pool
+        os._exit(status)
+    sys.exit(status)
+
+# }}}
+
+if __name__ == '__main__':
+    main()
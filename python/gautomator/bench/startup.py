@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2007 David JL <izimobil@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# $Id$
+
+"""
+Command line startup benchmark.
+
+For each command of bin/gautomator, loads the main script and the modules
+the command imports in a fresh interpreter (the run command also runs a one
+action workflow, as its jobs do), with every import timed like
+"python -X importtime" does, and reports the best total import time, the
+number of modules loaded and the slowest imports.
+The exit status is 1 if a command imports a module it must not import (gtk,
+the mime database, zipfile outside of install...), so that the script can
+be used to catch startup regressions.
+"""
+
+__version__ = '$Revision$'
+__author__  = 'David JEAN LOUIS <izimobil@gmail.com>'
+
+# dependencies {{{
+
+import os
+import sys
+import subprocess
+import optparse
+
+cur_dir = os.path.abspath(os.path.dirname(__file__))
+
+# }}}
+# constants {{{
+
+# modules that no command line command should ever import
+FORBIDDEN = ['gtk', 'gobject', 'gautomator.ui', 'mimetypes',
+             'multiprocessing']
+
+# (command, imports done by the command, modules it must not import)
+COMMANDS = [
+    ('help', '',
+     ['tempfile', 'zipfile', 'shutil', 'xml.etree']),
+    ('install', 'from gautomator.core.controllers import ActionManager',
+     []),
+    ('run', 'from gautomator.core import helpers, scheduler\n'
+            'from gautomator.core.daemon import Daemon\n'
+            'from gautomator.core.controllers import WorkflowManager\n'
+            'from gautomator.core import models\n'
+            # a one action workflow, like the jobs of the run command
+            'class Echo:\n'
+            '    info = {"id": "echo", "version": "0.1.0"}\n'
+            '    def process(self, items):\n'
+            '        return iter(items)\n'
+            'workflow = models.Workflow(name="bench")\n'
+            'workflow.append(Echo())\n'
+            'list(workflow.run("item"))',
+     ['zipfile', 'shutil']),
+    ('cache', 'from gautomator.core import cache',
+     ['zipfile', 'xml.etree']),
+]
+
+# code run in the child interpreter, it prints one line per imported module:
+# "self time in us|cumulative time in us|depth|module name"
+CHILD = r'''
+import sys, time, __builtin__
+sys.path.insert(0, %(root)r)
+_import = __builtin__.__import__
+_stack = [0]
+_records = []
+def _timed_import(name, *args):
+    before = len(sys.modules)
+    _stack.append(0)
+    start = time.time()
+    try:
+        return _import(name, *args)
+    finally:
+        elapsed = time.time() - start
+        children = _stack.pop()
+        _stack[-1] += elapsed
+        if len(sys.modules) != before:
+            _records.append((elapsed - children, elapsed, len(_stack), name))
+__builtin__.__import__ = _timed_import
+start = time.time()
+execfile(%(script)r, {'__name__': 'gautomator_bin', '__file__': %(script)r})
+exec %(code)r
+total = time.time() - start
+__builtin__.__import__ = _import
+for self_time, cumulative, depth, name in _records:
+    print '%%d|%%d|%%d|%%s' %% (self_time * 1e6, cumulative * 1e6, depth, name)
+print 'total|%%d' %% (total * 1e6)
+print 'modules|%%s' %% ' '.join(sorted(
+    [k for k, v in sys.modules.items() if v is not None]))
+'''
+
+# }}}
+# measure() {{{
+
+def measure(code):
+    """
+    Run the given import code after the main script in a new interpreter,
+    return a (total time, imports, modules) tuple, where imports is a list of
+    (self time, cumulative time, depth, name) tuples in import order.
+    """
+    root = os.path.join(cur_dir, '..')
+    script = os.path.join(root, 'bin', 'gautomator')
+    child = CHILD % {'root': root, 'script': script, 'code': code}
+    proc = subprocess.Popen([sys.executable, '-c', child],
+                            stdout=subprocess.PIPE)
+    out = proc.communicate()[0]
+    if proc.returncode:
+        raise Exception('benchmark interpreter exited with status %d' % \
+                        proc.returncode)
+    imports = []
+    total, modules = 0, []
+    for line in out.splitlines():
+        fields = line.split('|')
+        if fields[0] == 'total':
+            total = int(fields[1]) / 1e6
+        elif fields[0] == 'modules':
+            modules = fields[1].split()
+        else:
+            imports.append((int(fields[0]) / 1e6, int(fields[1]) / 1e6,
+                            int(fields[2]), fields[3]))
+    return (total, imports, modules)
+
+# }}}
+# main() {{{
+
+def main():
+    parser = optparse.OptionParser()
+    parser.usage = '%prog [options] [command1 command2 ...]'
+    parser.add_option('-r', '--repeat', dest='repeat', type='int',
+        default=5, help='number of runs, the best time is reported')
+    parser.add_option('-t', '--top', dest='top', type='int', default=5,
+        help='number of slowest imports shown per command')
+    parser.add_option('-v', '--verbose', dest='verbose', action='store_true',
+        default=False, help='print every import, like -X importtime')
+    (options, args) = parser.parse_args()
+    status = 0
+    print '%-8s %10s %8s' % ('command', 'imports', 'modules')
+    for cmd, code, forbidden in COMMANDS:
+        if args and cmd not in args:
+            continue
+        runs = [measure(code) for i in range(max(options.repeat, 1))]
+        total, imports, modules = min(runs)
+        print '%-8s %8.1fms %8d' % (cmd, total * 1000, len(modules))
+        if options.verbose:
+            for self_time, cumulative, depth, name in imports:
+                print '    %8d | %8d | %s%s' % (self_time * 1e6,
+                    cumulative * 1e6, '  ' * (depth - 1), name)
+        else:
+            top = [i for i in imports if i[2] == 1]
+            top.sort(key=lambda i: -i[1])
+            for self_time, cumulative, depth, name in top[:options.top]:
+                print '    %8.1fms %s' % (cumulative * 1000, name)
+        for name in FORBIDDEN + forbidden:
+            found = [m for m in modules
+                     if m == name or m.startswith(name + '.')]
+            if found:
+                print '    error: %s imports %s' % (cmd, ', '.join(found))
+                status = 1
+    sys.exit(status)
+
+# }}}
+
+if __name__ == '__main__':
+    main()
@@ -28,4 +28,6 @@ gautomator core module.
 
 __version__ = '$Revision$'
 __author__  = 'David JEAN LOUIS <izimobil@gmail.com>'
-__all__     = ['controllers', 'helpers', 'models', 'settings', 'types']
+__all__     = ['cache', 'chaining', 'controllers', 'daemon', 'engine',
+               'helpers', 'manifest', 'models', 'scheduler', 'settings',
+               'types', 'watcher']
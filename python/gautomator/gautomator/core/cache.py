@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2007 David JL <izimobil@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# $Id$
+
+"""
+On disk cache of action results.
+
+The outputs of a cacheable action (<cacheable>true</cacheable> in its
+action.xml) for a given input item are stored under a key computed from the
+action id and version, the parameters values and the input item (its path,
+mtime and size when the item is an existing file, the mtime and size of every
+file it contains when it is a directory). When a workflow is run again, cache
+hits are replayed instead of running the action, unless one of the output
+files changed since it was cached.
+The size of the entries is bounded, least recently used entries are
+evicted first. Output files belong to the user: they are neither counted nor
+removed, evicted entries are just forgotten.
+"""
+
+__version__ = '$Revision$'
+__author__  = 'David JEAN LOUIS <izimobil@gmail.com>'
+__all__     = ['MAX_SIZE', 'run', 'make_key', 'get', 'put', 'evict', 'info',
+               'clear']
+
+# dependencies {{{
+
+import os
+import stat
+import shutil
+import threading
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+from gautomator.core import settings
+
+# }}}
+# constants {{{
+
+MAX_SIZE = 256 * 1024 * 1024
+# version of the entries format, entries of other versions are misses
+ENTRY_VERSION = 3
+# bytes written since the last eviction scan
+_written = [0]
+
+# }}}
+# run() {{{
+
+def run(action, item, params):
+    """
+    Return the list of outputs of action.run(item, **params), from the cache
+    if possible.
+    """
+    if not action.info.get('cacheable'):
+        return list(action.run(item, **params))
+    key = make_key(action, item, params)
+    outputs = get(key)
+    if outputs is None:
+        outputs = list(action.run(item, **params))
+        put(key, outputs)
+    return outputs
+
+# }}}
+# make_key() {{{
+
+def make_key(action, item, params):
+    """
+    Return the cache key of the given action, input item and parameters.
+    """
+    if isinstance(item, basestring) and os.path.exists(item):
+        fingerprint = ('file', os.path.abspath(item), _signature(item))
+    else:
+        fingerprint = ('data', pickle.dumps(item, pickle.HIGHEST_PROTOCOL))
+    data = (action.info['id'], action.info['version'],
+            sorted(params.items()), fingerprint)
+    return sha1(repr(data)).hexdigest()
+
+# }}}
+# get() {{{
+
+def get(key):
+    """
+    Return the cached outputs for the given key or None if there is no entry
+    or if one of the cached output files was removed or modified since, by
+    a run with other parameters for instance.
+    """
+    path = _get_path(key)
+    entry = _load(path)
+    if entry is None:
+        return None
+    outputs, signatures = entry
+    for out, signature in signatures:
+        if _signature(out) != signature:
+            return None
+    try:
+        # the mtime of entries is used as the LRU clock
+        os.utime(path, None)
+    except OSError, exc:
+        pass
+    return outputs
+
+# }}}
+# put() {{{
+
+def put(key, outputs):
+    """
+    Store the given outputs list in the cache, failures are ignored.
+    """
+    path = _get_path(key)
+    tmp = '%s.%s.%s' % (path, os.getpid(), threading.currentThread().ident)
+    signatures = [(out, _signature(out)) for out in outputs
+                  if isinstance(out, basestring) and os.path.isabs(out)]
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), 0700)
+        fh = open(tmp, 'wb')
+        try:
+            pickle.dump((ENTRY_VERSION, outputs, signatures), fh,
+                        pickle.HIGHEST_PROTOCOL)
+        finally:
+            fh.close()
+        os.rename(tmp, path)
+        _written[0] += os.path.getsize(path)
+    except Exception, exc:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        return
+    if _written[0] > MAX_SIZE / 10:
+        evict()
+
+# }}}
+# evict() {{{
+
+def evict(max_size=None):
+    """
+    Remove the least recently used entries until the cache size is lower
+    than max_size (MAX_SIZE by default).
+    """
+    if max_size is None:
+        max_size = MAX_SIZE
+    _written[0] = 0
+    entries = []
+    total = 0
+    for path, st in _walk():
+        entries.append((st.st_mtime, st.st_size, path))
+        total += st.st_size
+    if total <= max_size:
+        return
+    entries.sort()
+    for mtime, size, path in entries:
+        if total <= max_size * 0.9:
+            break
+        try:
+            os.unlink(path)
+            total -= size
+        except OSError, exc:
+            pass
+
+# }}}
+# info() {{{
+
+def info():
+    """
+    Return a (number of entries, total size in bytes) tuple.
+    """
+    count = total = 0
+    for path, st in _walk():
+        count += 1
+        total += st.st_size
+    return (count, total)
+
+# }}}
+# clear() {{{
+
+def clear():
+    """
+    Remove all cache entries.
+    """
+    cache_dir = settings.get_cache_dir()
+    if os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
+
+# }}}
+# _get_path() {{{
+
+def _get_path(key):
+    return os.path.join(settings.get_cache_dir(), key[:2], key)
+
+# }}}
+# _walk() {{{
+
+def _walk():
+    """
+    Yield a (path, stat) tuple for each cache entry.
+    """
+    for root, dirs, files in os.walk(settings.get_cache_dir()):
+        for f in files:
+            path = os.path.join(root, f)
+            try:
+                yield (path, os.stat(path))
+            except OSError, exc:
+                pass
+
+# }}}
+# _load() {{{
+
+def _load(path):
+    """
+    Return the (outputs, signatures) tuple stored in the given entry file,
+    or None if it cannot be read.
+    """
+    try:
+        fh = open(path, 'rb')
+        try:
+            version, outputs, signatures = pickle.load(fh)
+        finally:
+            fh.close()
+    except Exception, exc:
+        return None
+    if version != ENTRY_VERSION:
+        return None
+    return (outputs, signatures)
+
+# }}}
+# _signature() {{{
+
+def _signature(path):
+    """
+    Return the signature of the given file or directory, the signature of
+    a directory covers the mtime and size of every file it contains. The
+    signature of a missing path is None.
+    """
+    try:
+        st = os.stat(path)
+    except OSError, exc:
+        return None
+    if not stat.S_ISDIR(st.st_mode):
+        return (st.st_mtime, st.st_size)
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        for name in sorted(names):
+            p = os.path.join(root, name)
+            try:
+                fst = os.stat(p)
+            except OSError, exc:
+                continue
+            files.append((p[len(path):], fst.st_mtime, fst.st_size))
+    return (st.st_mtime, sha1(repr(files)).hexdigest())
+
+# }}}
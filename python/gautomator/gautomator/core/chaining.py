@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2007 David JL <izimobil@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# $Id$
+
+"""
+Chaining rules of gautomator actions.
+
+An action B can follow an action A if the input type of B accepts the output
+type of A and if one of the mimetypes produced by A is accepted by B, where
+"audio/*" matches every audio mimetype and an empty mimetype list or "*/*"
+matches everything.
+
+Many actions share the same input and output declarations, so the index
+groups actions by signature, a (type, mimetypes) tuple, and precomputes the
+compatible signature pairs with inverted indexes by mimetype and by family,
+instead of comparing every pair of actions.
+"""
+
+__version__ = '$Revision$'
+__author__  = 'David JEAN LOUIS <izimobil@gmail.com>'
+__all__     = ['ChainIndex', 'get_signature', 'types_match',
+               'mimetypes_match']
+
+# dependencies {{{
+
+from gautomator.core.models import Input
+
+# }}}
+# get_signature() {{{
+
+def get_signature(io):
+    """
+    Return the hashable (type, mimetypes) signature of the given Input or
+    Output instance, mimetypes is a frozenset of lowercase mimetypes, empty
+    if everything is accepted or produced.
+    """
+    if getattr(io, 'mimetypes', None) is None:
+        # no input or output declared
+        return (None, frozenset())
+    mimes = set()
+    for m in io.mimetypes:
+        m = m.strip().lower()
+        if m in ('*', '*/*'):
+            # matches everything
+            return (io.type, frozenset())
+        if m:
+            mimes.add(m)
+    return (io.type, frozenset(mimes))
+
+# }}}
+# types_match() {{{
+
+def types_match(out_type, in_type):
+    """
+    Return True if an input of type in_type accepts an output of type
+    out_type, a None type matches every type.
+    """
+    if out_type is None or in_type is None or out_type == in_type:
+        return True
+    # folders are a particular case of files and folders
+    return out_type == Input.TYPE_FOLDERS and \
+           in_type == Input.TYPE_FILESANDFOLDERS
+
+# }}}
+# mimetypes_match() {{{
+
+def mimetypes_match(out_mimes, in_mimes):
+    """
+    Return True if one of the mimetypes of out_mimes is accepted by one of
+    the mimetypes of in_mimes, wildcard families like "audio/*" are allowed
+    on both sides and an empty list matches everything.
+    """
+    if not out_mimes or not in_mimes:
+        return True
+    for o in out_mimes:
+        for i in in_mimes:
+            if o == i or (i.endswith('/*') and o.startswith(i[:-1])) or \
+               (o.endswith('/*') and i.startswith(o[:-1])):
+                return True
+    return False
+
+# }}}
+# class ChainIndex {{{
+
+class ChainIndex:
+    """
+    Precomputed chaining compatibility of a set of actions.
+    """
+
+    def __init__(self, actions):
+        """
+        Constructor, build the index of the given list of actions.
+        """
+        self.actions = list(actions)
+        self.signatures = {}
+        in_groups = {}
+        for a in self.actions:
+            out_sig = get_signature(a.info['output'])
+            in_sig = get_signature(a.info['input'])
+            self.signatures[a.info['id']] = (out_sig, in_sig)
+            in_groups.setdefault(in_sig, []).append(a)
+        self.in_groups = in_groups
+        # inverted indexes of input signatures
+        universal = set()
+        by_mime = {}
+        by_family = {}
+        by_wildcard = {}
+        for in_sig in in_groups:
+            if not in_sig[1]:
+                universal.add(in_sig)
+            for m in in_sig[1]:
+                family = m.split('/')[0]
+                by_family.setdefault(family, set()).add(in_sig)
+                if m.endswith('/*'):
+                    by_wildcard.setdefault(family, set()).add(in_sig)
+                else:
+                    by_mime.setdefault(m, set()).add(in_sig)
+        # compatible input signatures of every output signature
+        self.compatible = {}
+        for out_sig, in_sig in self.signatures.values():
+            if out_sig in self.compatible:
+                continue
+            if not out_sig[1]:
+                candidates = set(in_groups)
+            else:
+                candidates = set(universal)
+                for m in out_sig[1]:
+                    family = m.split('/')[0]
+                    if m.endswith('/*'):
+                        candidates.update(by_family.get(family, ()))
+                    else:
+                        candidates.update(by_mime.get(m, ()))
+                        candidates.update(by_wildcard.get(family, ()))
+            self.compatible[out_sig] = frozenset([s for s in candidates
+                if types_match(out_sig[0], s[0])])
+        self._successors = {}
+
+    def can_chain(self, src, dst):
+        """
+        Return True if the action dst can follow the action src.
+        """
+        out_sig = self._get_signatures(src)[0]
+        in_sig = self._get_signatures(dst)[1]
+        compatible = self.compatible.get(out_sig)
+        if compatible is None or in_sig not in self.in_groups:
+            # action not in the index
+            return types_match(out_sig[0], in_sig[0]) and \
+                   mimetypes_match(out_sig[1], in_sig[1])
+        return in_sig in compatible
+
+    def get_successors(self, action):
+        """
+        Return the list of indexed actions that can follow the given action,
+        in the order of the indexed actions list.
+        """
+        out_sig = self._get_signatures(action)[0]
+        if out_sig not in self._successors:
+            compatible = self.compatible.get(out_sig)
+            if compatible is None:
+                compatible = [s for s in self.in_groups
+                              if types_match(out_sig[0], s[0]) and \
+                                 mimetypes_match(out_sig[1], s[1])]
+            ids = set()
+            for in_sig in compatible:
+                ids.update([id(a) for a in self.in_groups[in_sig]])
+            self._successors[out_sig] = [a for a in self.actions
+                                         if id(a) in ids]
+        return self._successors[out_sig]
+
+    def _get_signatures(self, action):
+        """
+        Return the (output signature, input signature) of the given action.
+        """
+        sigs = self.signatures.get(action.info['id'])
+        if sigs is None:
+            sigs = (get_signature(action.info['output']),
+                    get_signature(action.info['input']))
+        return sigs
+
+# }}}
@@ -32,20 +32,15 @@ __all__     = ['ActionManager', 'CategoryManager', 'WorkflowManager']
 
 # dependencies {{{
 
-import fcntl
 import os
 import sys
-import shutil
-import zipfile
+import threading
 try:
     import cPickle as pickle
 except:
     import pickle
-try:
-    import xml.etree.cElementTree as etree
-except ImportError:
-    import xml.etree.ElementTree as etree
 
+from gautomator.core import chaining
 from gautomator.core import helpers
 from gautomator.core import settings
 from gautomator.core import models
@@ -59,54 +54,290 @@ class ActionManager:
     remove or get informations about actions.
     """
     __cache__ = []
+    __index__ = {}
+    __category_index__ = {}
+    __chain_index__ = None
+    __entries__ = {}
+    _lock = threading.RLock()
+    INDEX_VERSION = 6
+    DISCOVERY_WORKERS = 0
+    INSTALL_WORKERS = 4
 
     @classmethod
     def get(cls, action_id):
         """
-        Return the category which name matches 'name'.
+        Return the action which id matches 'action_id'.
         """
-        for a in cls.get_all():
-            if a.info['id'] == action_id:
-                return a
+        cls.get_all()
+        return cls.__index__.get(action_id)
+
+    @classmethod
+    def find(cls, action_id):
+        """
+        Return the action which id matches 'action_id' without loading the
+        whole registry if it is not loaded yet, only the directories of this
+        action id are looked up.
+        """
+        if len(cls.__cache__):
+            return cls.__index__.get(action_id)
+        index = None
+        # user actions take precedence over builtin ones, as in get_all()
+        for p in [settings.get_user_actions_dir(),
+                  settings.get_builtin_actions_dir()]:
+            for d in [os.path.join(p, action_id),
+                      os.path.join(p, action_id + '.zip')]:
+                if not os.path.exists(d):
+                    continue
+                if index is None:
+                    index = cls._load_index()
+                entry = cls._read_action(d, index.get(d))
+                if entry is not None:
+                    return models.LazyAction.from_info(dict(entry[1], path=d))
+        return None
 
     @classmethod
     def get_by_category(cls, category):
         """
-        Return the category which name matches 'name'.
+        Return the actions belonging to the given category.
         """
         if category.name.lower() == 'all':
             return cls.get_all()
-        return [a for a in cls.get_all() if category in a.info['categories']]
+        cls.get_all()
+        return cls.__category_index__.get(category.name.lower(), [])
 
     @classmethod
-    def get_all(cls, force_reload=False):
+    def can_chain(cls, src, dst):
+        """
+        Return True if the action dst accepts what the action src produces,
+        that is if dst can follow src in a workflow.
+        """
+        cls.get_all()
+        return cls.__chain_index__.can_chain(src, dst)
+
+    @classmethod
+    def get_successors(cls, action):
+        """
+        Return the actions that can follow the given action in a workflow.
+        """
+        cls.get_all()
+        return cls.__chain_index__.get_successors(action)
+
+    @classmethod
+    def get_all(cls, force_reload=False, workers=None):
         """
         Return all available actions.
+        If workers is greater than 1 (it defaults to DISCOVERY_WORKERS), the
+        action directories are read concurrently by a pool of threads, which
+        helps a lot when actions live on a high latency filesystem (NFS).
         """
-        if force_reload:
-            cls.__cache__ = []
-        if not len(cls.__cache__):
-            sys_dir = settings.get_builtin_actions_dir()
-            user_dir = settings.get_user_actions_dir()
-            dirs = [os.path.join(sys_dir, d) for d in os.listdir(sys_dir)] + \
-                   [os.path.join(user_dir, d) for d in os.listdir(user_dir)]
-            sys.path.append(sys_dir)
-            sys.path.append(user_dir)
-            for d in dirs:
-                try:
-                    xml = os.path.join(d, 'action.xml')
-                    assert os.path.exists(xml)
-                    node = etree.parse(xml).getroot()
-                    action_id = os.path.basename(d)
-                    mod = __import__(action_id)
-                    cls.__cache__.append(mod.UserAction.new(node))
-                except (AssertionError, ImportError), exc:
-                    pass
-            sys.path.remove(sys_dir)
-            sys.path.remove(user_dir)
-        cls.__cache__.sort()
+        cls._lock.acquire()
+        try:
+            if force_reload:
+                cls.__cache__ = []
+            if not len(cls.__cache__):
+                cls._load_all(workers)
+        finally:
+            cls._lock.release()
         return cls.__cache__
 
+    @classmethod
+    def refresh(cls, paths=None):
+        """
+        Apply to the loaded registry the changes of the given action paths
+        (action directories or zip files), or of every action if paths is
+        None, and return an (added, updated, removed) tuple of action lists.
+        When paths is None, only the actions replaced or whose action.xml
+        file changed are re-read, the given paths are always re-read since
+        the other files of the actions are not checked (see the watcher).
+        The modules of updated or removed actions are unloaded.
+        Nothing is done if the registry is not loaded yet.
+        """
+        cls._lock.acquire()
+        try:
+            if not len(cls.__cache__):
+                return ([], [], [])
+            by_path = dict([(a.path, a) for a in cls.__cache__])
+            entries = dict(cls.__entries__)
+            force = paths is not None
+            if paths is None:
+                paths = by_path.keys() + cls._list_action_paths()
+            added, updated, removed = [], [], []
+            for d in helpers.uniq(paths):
+                old = by_path.get(d)
+                if force:
+                    entry = cls._read_action(d)
+                else:
+                    entry = cls._read_action(d, entries.get(d))
+                if entry is None:
+                    if old is not None:
+                        removed.append(by_path.pop(d))
+                        del entries[d]
+                elif old is None or entry is not entries.get(d):
+                    action = models.LazyAction.from_info(
+                        dict(entry[1], path=d))
+                    if old is None:
+                        added.append(action)
+                    else:
+                        updated.append(action)
+                    by_path[d] = action
+                    entries[d] = entry
+            if not (added or updated or removed):
+                return ([], [], [])
+            for a in updated + removed:
+                # the new version is imported when next needed
+                action_id = a.info['id']
+                for name in sys.modules.keys():
+                    if name == action_id or name.startswith(action_id + '.'):
+                        del sys.modules[name]
+            # same order as a full load so that user actions still override
+            # the builtin ones with the same id
+            order = cls._list_action_paths()
+            known = set(order)
+            actions = [by_path[d] for d in sorted(by_path) if d not in known]
+            actions += [by_path[d] for d in order if d in by_path]
+            cls.__entries__ = entries
+            cls._build_indexes(actions)
+            cls._save_index(entries)
+            return (added, updated, removed)
+        finally:
+            cls._lock.release()
+
+    @classmethod
+    def _load_all(cls, workers=None):
+        """
+        Load the registry, see get_all().
+        """
+        dirs = cls._list_action_paths()
+        index = cls._load_index()
+        if workers is None:
+            workers = cls.DISCOVERY_WORKERS
+        read = lambda d: cls._read_action(d, index.get(d))
+        if workers > 1 and len(dirs) > 1:
+            entries = helpers.parallel_map(read, dirs, workers)
+        else:
+            entries = [read(d) for d in dirs]
+        cache = []
+        new_index = {}
+        dirty = False
+        for d, entry in zip(dirs, entries):
+            if entry is None:
+                continue
+            dirty = dirty or entry is not index.get(d)
+            # the action module is only imported when first needed
+            cache.append(models.LazyAction.from_info(dict(entry[1], path=d)))
+            new_index[d] = entry
+        if dirty or len(new_index) != len(index):
+            cls._save_index(new_index)
+        cls.__entries__ = new_index
+        cls._build_indexes(cache)
+
+    @staticmethod
+    def _list_action_paths():
+        """
+        Return the list of the entries of the builtin and user actions
+        directories, user actions come last so that they take precedence.
+        """
+        ret = []
+        for p in [settings.get_builtin_actions_dir(),
+                  settings.get_user_actions_dir()]:
+            ret += [os.path.join(p, d) for d in os.listdir(p)
+                    if not d.startswith('.')]
+        return ret
+
+    @staticmethod
+    def _read_action(action_dir, entry=None):
+        """
+        Return the registry index entry of the given action directory or
+        zipped action, entry is the current index entry and is returned as is
+        if the action was not replaced and its action.xml file did not
+        change (see _get_stamp()). None is returned if the directory is not
+        an action.
+        """
+        zipped = action_dir.endswith('.zip')
+        try:
+            stamp = _get_stamp(action_dir)
+        except OSError, exc:
+            return None
+        if entry is None or entry[0] != stamp:
+            # new or modified action, parse its xml file
+            if zipped:
+                import zipfile
+                try:
+                    zf = zipfile.ZipFile(action_dir)
+                    try:
+                        node = _parse_xml(zf.open('action.xml')).getroot()
+                    finally:
+                        zf.close()
+                except (KeyError, IOError, zipfile.BadZipfile), exc:
+                    # not an action, corrupted or still being copied
+                    return None
+            else:
+                xml = os.path.join(action_dir, 'action.xml')
+                node = _parse_xml(xml).getroot()
+            entry = (stamp, models.Action.parse_info(node))
+        return entry
+
+    @classmethod
+    def _build_indexes(cls, actions):
+        """
+        Rebuild the cache, the lookup tables by id and by category name and
+        the chaining index from the given actions, which are in the order of
+        _list_action_paths(): the last action with a given id wins.
+        """
+        # the tables are built aside and then swapped, so that they can be
+        # read while the registry is refreshed
+        index = {}
+        for a in actions:
+            index[a.info['id']] = a
+        cache = sorted(actions, key=lambda a: (a.info['name'], a.info['id']))
+        category_index = {}
+        for a in cache:
+            for cat in a.info['categories']:
+                category_index.setdefault(cat.name.lower(), []).append(a)
+        cls.__cache__ = cache
+        cls.__index__ = index
+        cls.__category_index__ = category_index
+        cls.__chain_index__ = chaining.ChainIndex(cache)
+
+    @staticmethod
+    def _load_index():
+        """
+        Load the action registry index, a dict mapping action directories to
+        a (stamp, info) tuple. An empty dict is returned if the index
+        does not exist or cannot be read.
+        """
+        try:
+            fh = open(settings.get_action_registry_filepath(), 'rb')
+            try:
+                version, index = pickle.load(fh)
+            finally:
+                fh.close()
+            if version == ActionManager.INDEX_VERSION:
+                return index
+        except Exception, exc:
+            pass
+        return {}
+
+    @staticmethod
+    def _save_index(index):
+        """
+        Write the action registry index atomically, failures are ignored since
+        the index is just an optimization.
+        """
+        path = settings.get_action_registry_filepath()
+        tmp = '%s.%s' % (path, os.getpid())
+        try:
+            fh = open(tmp, 'wb')
+            try:
+                pickle.dump((ActionManager.INDEX_VERSION, index), fh,
+                            pickle.HIGHEST_PROTOCOL)
+            finally:
+                fh.close()
+            os.rename(tmp, path)
+        except Exception, exc:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
     @staticmethod
     def create(action_id, **kwargs):
         """
@@ -116,8 +347,7 @@ class ActionManager:
         action_id  = os.path.basename(action_id)
         # create directory of the action
         try:
-            assert(action_id not in [a.info['id']
-                   for a in ActionManager.get_all()])
+            assert(ActionManager.find(action_id) is None)
             os.mkdir(action_dir, 0744)
         except Exception, exc:
             raise Exception('Action "%s" already exists' % action_id)
@@ -125,7 +355,7 @@ class ActionManager:
         # write the xml file
         xmlfile = os.path.join(action_dir, 'action.xml')
         try:
-            xml = etree.parse(os.path.join(confdir, 'action.xml.in'))
+            xml = _parse_xml(os.path.join(confdir, 'action.xml.in'))
             xml.getroot().attrib['id'] = action_id
             # XXX todo fill the xml
             fh = open(xmlfile, 'w')
@@ -154,32 +384,106 @@ class ActionManager:
         return action_id
 
     @staticmethod
-    def install(action_path, system_wide=False):
+    def install(action_path, system_wide=False, zipped=False):
         """
         Install the given action (either an  action directory or an action zip
         file) system wide if the system_wide param is set to True or in the
         user home directory otherwise.
+        See install_many() for the zipped argument.
+        """
+        return ActionManager.install_many([action_path], system_wide,
+                                          zipped=zipped)[0]
+
+    @classmethod
+    def install_many(cls, action_paths, system_wide=False, update=False,
+                     workers=None, zipped=False):
+        """
+        Install the given actions (action directories or action zip files)
+        in one go and return the list of their ids. Bundles are validated and
+        extracted concurrently by 'workers' threads (INSTALL_WORKERS by
+        default) into a staging directory, then renamed into place, so that
+        either all the actions are installed or none is. If update is True,
+        the actions must already be installed and are replaced.
+        If zipped is True, zip files are installed as is, as a single
+        <action id>.zip file the action is run from (see
+        LazyAction.get_action()), instead of being extracted.
+        The registry index is refreshed once all actions are in place.
         """
-        if not os.path.exists(action_path):
-            raise Exception('"%s" not found, please provide the path to the'\
-                            ' action you want to install' % action_path)
-        action_id = os.path.basename(action_path)
         if system_wide:
             path = settings.get_builtin_actions_dir()
         else:
             path = settings.get_user_actions_dir()
         if not os.path.exists(path):
             os.makedirs(path, 0744)
-        if not helpers.is_valid_action(action_path):
-            raise Exception('Invalid action "%s"' % action_path)
-        destpath = os.path.join(path, action_id)
-        if os.path.exists(destpath):
-            raise Exception('Action "%s" already installed' % action_id)
-        if zipfile.is_zipfile(action_path):
-            helpers.extract_zipfile(action_path, path)
-        else:
-            shutil.copytree(action_path, destpath)
-        return action_id
+        verb = update and 'update' or 'install'
+        ids = []
+        names = []
+        for action_path in action_paths:
+            if not os.path.exists(action_path):
+                raise Exception('"%s" not found, please provide the path to '\
+                    'the action you want to %s' % (action_path, verb))
+            action_id = _get_bundle_id(action_path)
+            if action_id in ids:
+                raise Exception('Action "%s" given twice' % action_id)
+            installed = [n for n in [action_id, action_id + '.zip']
+                         if os.path.exists(os.path.join(path, n))]
+            if installed and not update:
+                raise Exception('Action "%s" already installed' % action_id)
+            if update and not installed:
+                raise Exception('Action "%s" is not installed' % action_id)
+            ids.append(action_id)
+            if zipped and not os.path.isdir(action_path):
+                names.append((action_id + '.zip', installed))
+            else:
+                names.append((action_id, installed))
+        import shutil
+        import tempfile
+        # the staging directory is on the same filesystem as the actions
+        # directory, so that actions can be renamed into place atomically
+        staging = tempfile.mkdtemp(prefix='.install-', dir=path)
+        moved = []
+        try:
+            stage = lambda p: _stage_action(p, staging, zipped)
+            if workers is None:
+                workers = cls.INSTALL_WORKERS
+            if workers > 1 and len(action_paths) > 1:
+                helpers.parallel_map(stage, action_paths, workers)
+            else:
+                for p in action_paths:
+                    stage(p)
+            for name, installed in names:
+                for n in installed:
+                    old = os.path.join(staging, '%s.old' % n)
+                    os.rename(os.path.join(path, n), old)
+                    moved.append((old, os.path.join(path, n)))
+                destpath = os.path.join(path, name)
+                os.rename(os.path.join(staging, name), destpath)
+                moved.append((destpath, None))
+        except:
+            # put everything back as it was
+            for src, dst in reversed(moved):
+                if dst is None:
+                    _remove(src)
+                else:
+                    os.rename(src, dst)
+            shutil.rmtree(staging, True)
+            raise
+        shutil.rmtree(staging, True)
+        if len(cls.__cache__):
+            # update the loaded registry, and its index, in place
+            cls.refresh([os.path.join(path, n) for name, installed in names
+                         for n in installed + [name]])
+            return ids
+        index = cls._load_index()
+        for name, installed in names:
+            for n in installed:
+                index.pop(os.path.join(path, n), None)
+            d = os.path.join(path, name)
+            entry = cls._read_action(d)
+            if entry is not None:
+                index[d] = entry
+        cls._save_index(index)
+        return ids
 
     @staticmethod
     def uninstall(action_id):
@@ -190,22 +494,23 @@ class ActionManager:
         for p in [settings.get_user_actions_dir(),
                   settings.get_builtin_actions_dir()]:
             d = os.path.join(p, '%s' % action_id)
-            if os.path.isfile(os.path.join(d, 'action.xml')):
-                shutil.rmtree(d)
+            if os.path.isfile(os.path.join(d, 'action.xml')) or \
+               os.path.isfile(d + '.zip'):
+                _remove(d)
+                _remove(d + '.zip')
+                ActionManager.refresh([d, d + '.zip'])
                 return action_id
         raise Exception('Action "%s" is not installed' % action_id)
 
     @staticmethod
-    def update(action_path):
+    def update(action_path, system_wide=False, zipped=False):
         """
-        Install the given action (the path to the action directory or action
-        zip file). This is a shortcut to uninstall/install.
+        Replace the installed action with the given action (the path to the
+        action directory or action zip file).
+        See install_many() for the zipped argument.
         """
-        if not os.path.exists(action_path):
-            raise Exception('"%s" not found, please provide the path to the'\
-                            ' action you want to update' % action_path)
-        ActionManager.uninstall(os.path.basename(action_path))
-        return ActionManager.install(action_path)
+        return ActionManager.install_many([action_path], system_wide,
+                                          update=True, zipped=zipped)[0]
 
 
 # }}}
@@ -216,16 +521,15 @@ class CategoryManager:
     A simple class that manages categories.
     """
     __cache__ = []
+    __index__ = {}
 
     @classmethod
     def get(cls, name):
         """
         Return the category matching the given name.
         """
-        for c in cls.get_all():
-            if c.name.lower() == name.lower():
-                return c
-        return None
+        cls.get_all()
+        return cls.__index__.get(name.lower())
 
     @classmethod
     def get_all(cls, force_reload=False):
@@ -235,11 +539,12 @@ class CategoryManager:
         if force_reload:
             cls.__cache__ = []
         if not len(cls.__cache__):
-            tree = etree.parse(os.path.join(
+            tree = _parse_xml(os.path.join(
                 settings.get_config_dir(), 'categories.xml'
             ))
             for node in tree.getroot().findall('category'):
                 cls.__cache__.append(models.Category.new(node))
+            cls.__index__ = dict((c.name.lower(), c) for c in cls.__cache__)
         return cls.__cache__
 
 
@@ -250,8 +555,261 @@ class WorkflowManager:
     """
     A simple class that manages workflows, it can save, delete, load and
     organise workflows.
+
+    A workflow file contains two pickles: a small header (format version,
+    workflow name and action ids) followed by the workflow body (action ids,
+    parameters values and links), so listing workflows never needs to read
+    the body. Headers are also kept in an index file per workflows directory,
+    keyed by file name, mtime and size, so that unchanged workflow files are
+    not even opened when listing them.
+    """
+    FORMAT_VERSION = 1
+    EXTENSION = '.workflow'
+    INDEX_FILE = 'workflows.idx'
+
+    @classmethod
+    def get_all(cls):
+        """
+        Return the list of available workflows as dicts with the 'name',
+        'path' and 'actions' (list of action ids) keys, user workflows
+        first.
+        """
+        ret = []
+        for d in [settings.get_user_workflows_dir(),
+                  settings.get_builtin_workflows_dir()]:
+            if not os.path.isdir(d):
+                continue
+            index_path = os.path.join(d, cls.INDEX_FILE)
+            index = cls._load_pickle(index_path, {})
+            new_index = {}
+            dirty = False
+            for fname in sorted(os.listdir(d)):
+                if not fname.endswith(cls.EXTENSION):
+                    continue
+                path = os.path.join(d, fname)
+                try:
+                    st = os.stat(path)
+                    entry = index.get(fname)
+                    if entry is None or entry[0] != (st.st_mtime, st.st_size):
+                        entry = ((st.st_mtime, st.st_size),
+                                 cls._read_header(path))
+                        dirty = True
+                except Exception, exc:
+                    continue
+                new_index[fname] = entry
+                version, name, actions = entry[1]
+                ret.append({'name': name, 'path': path, 'actions': actions})
+            if dirty or len(new_index) != len(index):
+                try:
+                    cls._dump_pickles(index_path, new_index)
+                except Exception, exc:
+                    # read only directory (builtin workflows)
+                    pass
+        return ret
+
+    @classmethod
+    def get_path(cls, name):
+        """
+        Return the path of the workflow file for the given workflow name.
+        """
+        fname = name.replace(os.sep, '_') + cls.EXTENSION
+        path = os.path.join(settings.get_user_workflows_dir(), fname)
+        if not os.path.exists(path):
+            builtin = os.path.join(settings.get_builtin_workflows_dir(), fname)
+            if os.path.exists(builtin):
+                return builtin
+        return path
+
+    @classmethod
+    def save(cls, workflow, path=None):
+        """
+        Save the given workflow in the user workflows directory, or in the
+        given path, and return the path of the file.
+        """
+        if path is None:
+            path = os.path.join(settings.get_user_workflows_dir(),
+                workflow.name.replace(os.sep, '_') + cls.EXTENSION)
+        ids = [a.info['id'] for a in workflow.actions]
+        header = (cls.FORMAT_VERSION, workflow.name, ids)
+        body = (ids, workflow.parameters, workflow.links)
+        cls._dump_pickles(path, header, body)
+        return path
+
+    @classmethod
+    def load(cls, name_or_path):
+        """
+        Load the workflow identified by its name or the path to its file.
+        Only the actions used by the workflow are resolved.
+        """
+        path = name_or_path
+        if not os.path.isfile(path):
+            path = cls.get_path(name_or_path)
+        if not os.path.isfile(path):
+            raise Exception('Workflow "%s" not found' % name_or_path)
+        fh = open(path, 'rb')
+        try:
+            version, name, ids = pickle.load(fh)
+            if version != cls.FORMAT_VERSION:
+                raise Exception('Unsupported workflow format version %s' % \
+                    version)
+            ids, params, links = pickle.load(fh)
+        finally:
+            fh.close()
+        workflow = models.Workflow(name=name)
+        for action_id, action_params in zip(ids, params):
+            action = ActionManager.find(action_id)
+            if action is None:
+                raise Exception('Workflow "%s" requires action "%s" which is '\
+                                'not installed' % (name, action_id))
+            workflow.append(action, action_params)
+        for src, dst in links:
+            workflow.connect(src, dst)
+        return workflow
+
+    @classmethod
+    def delete(cls, name):
+        """
+        Delete the user workflow identified by the given name.
+        """
+        path = os.path.join(settings.get_user_workflows_dir(),
+            name.replace(os.sep, '_') + cls.EXTENSION)
+        if not os.path.isfile(path):
+            raise Exception('Workflow "%s" does not exist' % name)
+        os.unlink(path)
+        return name
+
+    @classmethod
+    def _read_header(cls, path):
+        """
+        Return the header of the given workflow file.
+        """
+        fh = open(path, 'rb')
+        try:
+            return pickle.load(fh)
+        finally:
+            fh.close()
+
+    @staticmethod
+    def _load_pickle(path, default=None):
+        """
+        Return the first object pickled in path or default on failure.
+        """
+        try:
+            fh = open(path, 'rb')
+            try:
+                return pickle.load(fh)
+            finally:
+                fh.close()
+        except Exception, exc:
+            return default
+
+    @staticmethod
+    def _dump_pickles(path, *objs):
+        """
+        Pickle the given objects in path, atomically.
+        """
+        tmp = '%s.%s' % (path, os.getpid())
+        try:
+            fh = open(tmp, 'wb')
+            try:
+                for obj in objs:
+                    pickle.dump(obj, fh, pickle.HIGHEST_PROTOCOL)
+            finally:
+                fh.close()
+            os.rename(tmp, path)
+        except:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+
+# }}}
+# _parse_xml() {{{
+
+def _parse_xml(source):
+    """
+    Parse the given xml file and return its element tree, ElementTree is only
+    imported when an xml file actually needs to be parsed.
+    """
+    try:
+        import xml.etree.cElementTree as etree
+    except ImportError:
+        import xml.etree.ElementTree as etree
+    return etree.parse(source)
+
+# }}}
+# _get_bundle_id() {{{
+
+def _get_bundle_id(action_path):
+    """
+    Return the id of the action in the given directory or zip file.
     """
-    pass
+    action_id = os.path.basename(os.path.normpath(action_path))
+    if not os.path.isdir(action_path):
+        # as extracted by helpers.extract_zipfile()
+        action_id = action_id.rsplit('.', 1)[0]
+    return action_id
 
+# }}}
+# _get_stamp() {{{
+
+def _get_stamp(action_path):
+    """
+    Return a tuple that changes when the given action directory or zip file
+    is replaced, as done by install and update, or when its action.xml file
+    changes. OSError is raised if there is no action.xml file.
+    """
+    st = os.stat(action_path)
+    if action_path.endswith('.zip'):
+        return (st.st_ino, st.st_mtime, st.st_size)
+    xml_st = os.stat(os.path.join(action_path, 'action.xml'))
+    return (st.st_ino, xml_st.st_mtime, xml_st.st_size)
+
+# }}}
+# _stage_action() {{{
+
+def _stage_action(action_path, staging, zipped=False):
+    """
+    Check that the given action directory or zip file is a valid action and
+    copy or extract it in the staging directory, zip files are copied as
+    <action id>.zip if zipped is True.
+    """
+    import zipfile
+    action_id = _get_bundle_id(action_path)
+    if os.path.isdir(action_path):
+        if not helpers.is_valid_action(action_path):
+            raise Exception('Invalid action "%s"' % action_path)
+        import shutil
+        shutil.copytree(action_path, os.path.join(staging, action_id))
+        return
+    try:
+        zf = zipfile.ZipFile(action_path)
+    except (IOError, zipfile.BadZipfile), exc:
+        raise Exception('Invalid action "%s"' % action_path)
+    try:
+        names = zf.namelist()
+        if 'action.xml' not in names or '__init__.py' not in names:
+            raise Exception('Invalid action "%s"' % action_path)
+        if zipped:
+            import shutil
+            shutil.copyfile(action_path,
+                            os.path.join(staging, action_id + '.zip'))
+        else:
+            helpers.extract_zipfile(zf, staging)
+    finally:
+        zf.close()
+
+# }}}
+# _remove() {{{
+
+def _remove(path):
+    """
+    Remove the given file or directory tree if it exists.
+    """
+    if os.path.isdir(path):
+        import shutil
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.unlink(path)
 
 # }}}
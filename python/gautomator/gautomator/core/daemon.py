@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2007 David JL <izimobil@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# $Id$
+
+"""
+gautomator daemon.
+
+The daemon keeps the action registry and the action modules loaded and runs
+the jobs written to the gautomator named pipe, one job per line:
+
+    [-p priority] workflow [input1 input2 ...]
+
+so that scripts can run workflows without paying the startup cost, e.g.:
+
+    echo 'mp3 to ogg "/home/john/My Music"' > $XDG_RUNTIME_DIR/gautomator.pipe
+
+The pipe lives in a directory only readable and writable by the user, see
+settings.get_named_pipe_filepath().
+
+Queued jobs are started by decreasing priority, and the actions of running
+jobs share the slots of the default scheduler.
+
+The special lines "!reload" and "!quit" respectively load the actions that
+were added, modified or removed since the registry was loaded and stop the
+daemon.
+"""
+
+__version__ = '$Revision$'
+__author__  = 'David JEAN LOUIS <izimobil@gmail.com>'
+__all__     = ['Daemon']
+
+# dependencies {{{
+
+import os
+import sys
+import logging
+import itertools
+import threading
+import Queue
+
+from gautomator.core import helpers
+from gautomator.core import settings
+
+# }}}
+# class Daemon {{{
+
+class Daemon:
+    """
+    Read jobs from the named pipe and run them with a pool of threads.
+    """
+
+    def __init__(self, path=None, workers=1, incremental=False):
+        """
+        Constructor.
+        """
+        self.path = path or settings.get_named_pipe_filepath()
+        self.workers = workers
+        self.incremental = incremental
+        self.jobs = Queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def serve(self):
+        """
+        Load the registry and serve jobs until a "!quit" line is received.
+        """
+        from gautomator.core.controllers import ActionManager
+        self.preload(ActionManager.get_all())
+        threads = [threading.Thread(target=self._worker)
+                   for i in range(max(self.workers, 1))]
+        for t in threads:
+            t.setDaemon(True)
+            t.start()
+        # opening the fifo read/write means we never get EOF when the last
+        # writer closes it
+        fh = os.fdopen(os.open(self.path, os.O_RDWR), 'r')
+        self.output('listening on %s' % self.path)
+        try:
+            while True:
+                line = fh.readline()
+                if line.strip() == '!quit':
+                    break
+                elif line.strip() == '!reload':
+                    added, updated, removed = ActionManager.refresh()
+                    self.preload(added + updated)
+                    continue
+                try:
+                    job = helpers.parse_job_line(line)
+                except ValueError, exc:
+                    self.output('invalid job "%s": %s' % (line.strip(), exc),
+                                sys.stderr)
+                    continue
+                if job is not None:
+                    self.submit(*job)
+        finally:
+            fh.close()
+        for t in threads:
+            # lower than any priority, so running and queued jobs complete
+            self.jobs.put((float('inf'), self.counter.next(), None))
+        for t in threads:
+            t.join()
+
+    def preload(self, actions):
+        """
+        Import the modules of the given actions.
+        """
+        for action in actions:
+            try:
+                action.get_action()
+            except Exception, exc:
+                logging.warning('unable to load action "%s": %s' % \
+                    (action.info['id'], exc))
+
+    def submit(self, name, inputs, priority=0):
+        """
+        Queue a job, jobs with a higher priority are run first.
+        """
+        self.jobs.put((-priority, self.counter.next(),
+                       (name, inputs, priority)))
+
+    def run_job(self, name, inputs, priority=0):
+        """
+        Run the given workflow and return True if it succeeded.
+        """
+        from gautomator.core.controllers import WorkflowManager
+        count = 0
+        kwargs = {'incremental': self.incremental, 'priority': priority}
+        try:
+            workflow = WorkflowManager.load(name)
+            for item in workflow.run(*inputs, **kwargs):
+                count += 1
+                self.output('%s: %s' % (name, item))
+        except Exception, exc:
+            self.output('%s: error: %s' % (name, exc), sys.stderr)
+            return False
+        self.output('%s: done, %d items' % (name, count))
+        return True
+
+    def output(self, msg, fh=None):
+        """
+        Write the given message on stdout or on the given file.
+        """
+        fh = fh or sys.stdout
+        self.lock.acquire()
+        try:
+            fh.write(msg + '\n')
+            fh.flush()
+        finally:
+            self.lock.release()
+
+    def _worker(self):
+        while True:
+            job = self.jobs.get()[2]
+            if job is None:
+                return
+            self.run_job(*job)
+
+# }}}
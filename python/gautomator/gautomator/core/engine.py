@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2007 David JL <izimobil@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# $Id$
+
+"""
+Workflow execution engine for gautomator.
+
+Actions are chained as generators: each action consumes the items produced
+by the previous one and yields its own items, so an item travels through the
+whole workflow before the next one is produced and no intermediate list is
+ever built.
+
+Workflows that are not a simple chain (an action feeding several actions or
+an action fed by several actions) are run by a scheduler that starts one
+thread per action, connected by bounded queues, so that independent branches
+run concurrently.
+"""
+
+__version__ = '$Revision$'
+__author__  = 'David JEAN LOUIS <izimobil@gmail.com>'
+__all__     = ['Cancelled', 'stream', 'run_graph', 'cpu_count']
+
+# class Cancelled {{{
+
+class Cancelled(Exception):
+    """
+    Raised inside a running workflow when it has been cancelled.
+    """
+    pass
+
+# }}}
+# stream() {{{
+
+def stream(steps, items, cancel_event=None, workers=None, scheduler=None,
+           priority=0):
+    """
+    Chain the given steps, a list of (action, params) tuples, and return a
+    generator yielding the items produced by the last action.
+    If cancel_event (a threading.Event) is set while the workflow runs,
+    Cancelled is raised at the next item boundary.
+    Actions declared as item parallel in their action.xml have their input
+    items dispatched to a pool of 'workers' processes (defaults to the number
+    of CPUs). Results of cacheable actions go through the results cache.
+    If a scheduler is given, each action holds a slot of its resource class,
+    requested with the given priority, while it processes an item.
+    """
+    if workers is None:
+        workers = cpu_count()
+    items = _check(iter(items), cancel_event)
+    for action, params in steps:
+        slots = None
+        if scheduler is not None:
+            slots = (scheduler, action.info.get('resource', 'cpu'), priority)
+        if workers > 1 and action.info.get('parallel'):
+            items = _parallel(action, params, items, workers,
+                              action.info.get('ordered', True), slots=slots)
+        else:
+            if slots is not None:
+                # the slot must not be held while upstream actions run, the
+                # lease tells whether it is currently held
+                lease = [False]
+                items = _released(items, lease, *slots)
+            if action.info.get('cacheable'):
+                items = _cached(action, params, items)
+            else:
+                items = action.process(items, **params)
+            if slots is not None:
+                items = _acquired(items, lease, *slots)
+        items = _check(items, cancel_event)
+    return items
+
+# }}}
+# run_graph() {{{
+
+def run_graph(steps, links, items, cancel_event=None, workers=None,
+              scheduler=None, priority=0, max_pending=64):
+    """
+    Run the directed acyclic graph of steps, a list of (action, params)
+    tuples, where links is a list of (src, dst) indexes meaning that the
+    output of steps[src] is fed to steps[dst]. The given items are fed to
+    every step without predecessor and the items produced by every step
+    without successor are yielded.
+    Each step runs in its own thread, steps are connected by queues holding at
+    most 'max_pending' items so that a slow branch throttles its producer.
+    A linear chain is run by stream() without any thread.
+    See stream() for the other arguments.
+    """
+    if list(links) == [(i, i+1) for i in range(len(steps)-1)]:
+        return stream(steps, items, cancel_event, workers, scheduler,
+                      priority)
+    return _run_graph(steps, links, items, cancel_event, workers, scheduler,
+                      priority, max_pending)
+
+# }}}
+# cpu_count() {{{
+
+def cpu_count():
+    """
+    Return the number of CPUs, or 1 if it cannot be determined.
+    """
+    import os
+    try:
+        # as multiprocessing does on unix, without importing it since every
+        # run needs the number of CPUs
+        count = os.sysconf('SC_NPROCESSORS_ONLN')
+        if count > 0:
+            return count
+    except (AttributeError, ValueError, OSError):
+        pass
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+# }}}
+# _check() {{{
+
+def _check(items, cancel_event):
+    """
+    Yield the given items, raising Cancelled if cancel_event is set.
+    """
+    for item in items:
+        if cancel_event is not None and cancel_event.isSet():
+            raise Cancelled()
+        yield item
+
+# }}}
+# _acquired() {{{
+
+def _acquired(items, lease, scheduler, resource, priority):
+    """
+    Yield the given items, holding a slot of the resource class while each
+    item is being produced. lease is a one element list shared with
+    _released(), telling whether the slot is held.
+    """
+    items = iter(items)
+    while True:
+        scheduler.acquire(resource, priority)
+        lease[0] = True
+        try:
+            item = items.next()
+        finally:
+            if lease[0]:
+                lease[0] = False
+                scheduler.release(resource)
+        yield item
+
+# }}}
+# _released() {{{
+
+def _released(items, lease, scheduler, resource, priority):
+    """
+    Yield the given items to a consumer wrapped by _acquired(), releasing
+    the slot of the consumer while the items are produced.
+    """
+    items = iter(items)
+    while True:
+        if lease[0]:
+            lease[0] = False
+            scheduler.release(resource)
+        # if upstream is exhausted or raised, the slot is not acquired back
+        # only to be released by _acquired()
+        item = items.next()
+        scheduler.acquire(resource, priority)
+        lease[0] = True
+        yield item
+
+# }}}
+# _cached() {{{
+
+def _cached(action, params, items):
+    """
+    Yield the outputs of action.run() for each of the given items, using the
+    results cache.
+    """
+    from gautomator.core import cache
+    for item in items:
+        for ret in cache.run(action, item, params):
+            yield ret
+
+# }}}
+# _parallel() {{{
+
+def _parallel(action, params, items, workers, ordered=True, max_pending=None,
+              slots=None):
+    """
+    Run action.run() on each of the given items in a pool of processes and
+    yield the results, in input order if 'ordered' is True or as soon as they
+    are available otherwise. At most 'max_pending' items (twice the number of
+    workers by default) are submitted and not yet consumed at any time, so the
+    input stream is never read ahead of the pool.
+    If slots, a (scheduler, resource, priority) tuple, is given, a slot is
+    acquired before each item is submitted and released when it is done.
+    """
+    import collections
+    import itertools
+    import multiprocessing
+    import threading
+    if max_pending is None:
+        max_pending = workers * 2
+    # the action and its parameters are inherited by the forked workers
+    pool = multiprocessing.Pool(workers, _init_worker, (action, params))
+    # submitted items not consumed yet
+    pending = collections.deque()
+    # keys of the submitted items holding a slot, released by the callback
+    # of apply_async() when the item is done, or when it is seen ready since
+    # the callback is not called if its result failed to come back, or when
+    # the pool is terminated
+    held = set()
+    lock = threading.Lock()
+    keys = itertools.count()
+    def release(key):
+        lock.acquire()
+        try:
+            if key not in held:
+                return
+            held.remove(key)
+        finally:
+            lock.release()
+        slots[0].release(slots[1])
+    def submit(item):
+        key = keys.next()
+        if slots is not None:
+            # never block while the slot of a failed item may be pending
+            while not slots[0].acquire(slots[1], slots[2], timeout=0.05):
+                for r in list(pending):
+                    if r.ready():
+                        release(r.key)
+            lock.acquire()
+            held.add(key)
+            lock.release()
+        result = pool.apply_async(_run_item, (item,),
+                                  callback=lambda ret: release(key))
+        result.key = key
+        return result
+    def collect(result):
+        try:
+            return _unpack(result.get())
+        finally:
+            release(result.key)
+    try:
+        if ordered:
+            for item in items:
+                pending.append(submit(item))
+                while pending and (len(pending) >= max_pending or \
+                                   pending[0].ready()):
+                    for ret in collect(pending.popleft()):
+                        yield ret
+            while pending:
+                for ret in collect(pending.popleft()):
+                    yield ret
+        else:
+            # results are polled rather than pushed by a callback, which
+            # is not called if the result of a worker cannot be sent back,
+            # get() raises the error instead
+            def pop_ready(block):
+                while True:
+                    ready = [r for r in pending if r.ready()]
+                    if ready or not block:
+                        for r in ready:
+                            pending.remove(r)
+                        return ready
+                    pending[0].wait(0.01)
+            for item in items:
+                pending.append(submit(item))
+                for r in pop_ready(len(pending) >= max_pending):
+                    for ret in collect(r):
+                        yield ret
+            while pending:
+                for r in pop_ready(True):
+                    for ret in collect(r):
+                        yield ret
+    except:
+        # error, cancellation or generator closed by the consumer, the
+        # callbacks of the pending items will never be called
+        pool.terminate()
+        pool.join()
+        for key in list(held):
+            release(key)
+        raise
+    pool.close()
+    pool.join()
+
+# }}}
+# _init_worker() {{{
+
+_worker = {}
+
+def _init_worker(action, params):
+    """
+    Initializer of the pool worker processes.
+    """
+    _worker['action'] = action
+    _worker['params'] = params
+
+# }}}
+# _run_item() {{{
+
+def _run_item(item):
+    """
+    Run the worker action on the given item, return a (success, value) tuple
+    where value is the list of output items or the exception raised.
+    """
+    from gautomator.core import cache
+    try:
+        return (True, cache.run(_worker['action'], item, _worker['params']))
+    except Exception, exc:
+        return (False, exc)
+
+# }}}
+# _unpack() {{{
+
+def _unpack(result):
+    """
+    Return the output items of a (success, value) tuple returned by
+    _run_item() or raise the exception it contains.
+    """
+    success, value = result
+    if not success:
+        raise value
+    return value
+
+# }}}
+# _run_graph() {{{
+
+def _run_graph(steps, links, items, cancel_event, workers, scheduler,
+               priority, max_pending):
+    """
+    Generator doing the actual work of run_graph().
+    """
+    import Queue
+    import sys
+    import threading
+    succs = [[] for s in steps]
+    npreds = [0 for s in steps]
+    for src, dst in links:
+        succs[src].append(dst)
+        npreds[dst] += 1
+    _check_acyclic(succs)
+    abort = threading.Event()
+    errors = []
+    inputs = [Queue.Queue(max_pending) for s in steps]
+    results = Queue.Queue(max_pending)
+    sinks = [i for i in range(len(steps)) if not succs[i]]
+
+    def put(q, elt):
+        while not abort.isSet():
+            try:
+                q.put(elt, True, 0.1)
+                return
+            except Queue.Full:
+                pass
+        raise Cancelled()
+
+    def drain(q, count):
+        while count:
+            try:
+                kind, value = q.get(True, 0.1)
+            except Queue.Empty:
+                if abort.isSet():
+                    raise Cancelled()
+                continue
+            if kind == 'eof':
+                count -= 1
+            else:
+                yield value
+
+    def run(targets, func, *args):
+        try:
+            for item in func(*args):
+                for q in targets:
+                    put(q, ('item', item))
+            for q in targets:
+                put(q, ('eof', None))
+        except Exception, exc:
+            if not abort.isSet():
+                errors.append(sys.exc_info())
+            abort.set()
+
+    threads = [threading.Thread(target=run, args=(
+        [inputs[i] for i in range(len(steps)) if not npreds[i]],
+        _check, iter(items), cancel_event))]
+    for i, step in enumerate(steps):
+        targets = [inputs[j] for j in succs[i]] or [results]
+        threads.append(threading.Thread(target=run, args=(targets, stream,
+            [step], drain(inputs[i], max(npreds[i], 1)), cancel_event,
+            workers, scheduler, priority)))
+    for t in threads:
+        t.setDaemon(True)
+        t.start()
+    try:
+        for item in drain(results, len(sinks)):
+            yield item
+    except Cancelled:
+        if not errors:
+            raise
+    finally:
+        abort.set()
+        for t in threads:
+            t.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+
+# }}}
+# _check_acyclic() {{{
+
+def _check_acyclic(succs):
+    """
+    Raise an exception if the graph given as successor lists has a cycle.
+    """
+    npreds = [0 for s in succs]
+    for targets in succs:
+        for j in targets:
+            npreds[j] += 1
+    ready = [i for i in range(len(succs)) if not npreds[i]]
+    count = 0
+    while ready:
+        i = ready.pop()
+        count += 1
+        for j in succs[i]:
+            npreds[j] -= 1
+            if not npreds[j]:
+                ready.append(j)
+    if count != len(succs):
+        raise Exception('Workflow actions graph contains a cycle')
+
+# }}}
@@ -28,8 +28,14 @@ gautomator helpers.
 
 __version__ = '$Revision$'
 __author__  = 'David JEAN LOUIS <izimobil@gmail.com>'
-__all__     = ['uniq', 'is_valid_action', 'extract_zipfile']
+__all__     = ['uniq', 'parallel_map', 'parse_job_line', 'is_valid_action',
+               'extract_zipfile']
 
+# dependencies {{{
+
+import sys
+
+# }}}
 # uniq() {{{
 
 def uniq(lst, sort=False):
@@ -43,6 +49,64 @@ def uniq(lst, sort=False):
         ret.sort()
     return ret
 
+# }}}
+# parallel_map() {{{
+
+def parallel_map(func, lst, workers):
+    """
+    Return [func(e) for e in lst], calling func from at most 'workers'
+    threads. Results are returned in the order of lst and the first exception
+    raised by func, if any, is re-raised.
+    """
+    import threading
+    lst = list(lst)
+    ret = [None] * len(lst)
+    errors = []
+    indexes = iter(range(len(lst)))
+    lock = threading.Lock()
+    def worker():
+        while not errors:
+            lock.acquire()
+            try:
+                i = indexes.next()
+            except StopIteration:
+                return
+            finally:
+                lock.release()
+            try:
+                ret[i] = func(lst[i])
+            except Exception, exc:
+                errors.append(sys.exc_info())
+    threads = [threading.Thread(target=worker)
+               for i in range(min(workers, len(lst)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return ret
+
+# }}}
+# parse_job_line() {{{
+
+def parse_job_line(line, priority=0):
+    """
+    Parse a job line of the form: [-p priority] workflow [input1 input2 ...]
+    (with shell quoting and comments) and return a (workflow, inputs,
+    priority) tuple, or None if the line is empty. The given priority is used
+    if the line does not specify one. ValueError is raised if the line cannot
+    be parsed.
+    """
+    import shlex
+    job = shlex.split(line, True)
+    if len(job) > 1 and job[0] == '-p':
+        priority = int(job[1])
+        job = job[2:]
+    if not job:
+        return None
+    return (job[0], job[1:], priority)
+
 # }}}
 # is_valid_action() {{{
 
@@ -67,30 +131,60 @@ def is_valid_action(action_path):
 # }}}
 # extract_zipfile() {{{
 
-def extract_zipfile(f, destdir):
+def extract_zipfile(f, destdir, workers=0, chunk_size=256*1024):
     """
-    Extract the zip file 'zf' to the destination dir 'destdir'.
+    Extract the zip file 'f', a path or an open zipfile.ZipFile, to a
+    directory named after it in 'destdir'.
+    Members are streamed to disk by chunks of 'chunk_size' bytes, so memory
+    usage does not depend on the size of the archive, their CRC is checked
+    and unix permissions stored in the archive are restored. If workers is
+    greater than 1, members are extracted concurrently by that many threads.
     """
     import os
-    destdir = os.path.join(destdir, os.path.basename(f).rsplit('.', 1)[0])
+    import zipfile
+    if isinstance(f, zipfile.ZipFile):
+        zf, f = f, f.filename
+    else:
+        zf = None
+    destdir = os.path.normpath(os.path.join(destdir,
+        os.path.basename(f).rsplit('.', 1)[0]))
     if os.path.exists(destdir):
         raise Exception('Directory "%s" already exists' % destdir)
     try:
         os.makedirs(destdir)
-        import zipfile
-        zf = zipfile.ZipFile(f)
-        for name in zf.namelist():
-            destpath = os.path.join(destdir, os.path.normpath(name))
-            if name.endswith('/'):
-                os.makedirs(destpath)
-            else:
-                parent = os.path.dirname(destpath)
-                if '/' in name and not os.path.exists(parent):
+        if zf is None:
+            zf = zipfile.ZipFile(f)
+            close = True
+        else:
+            close = False
+        try:
+            members = []
+            for info in zf.infolist():
+                destpath = os.path.normpath(os.path.join(destdir,
+                                                         info.filename))
+                # do not write outside of destdir
+                if os.path.isabs(info.filename) or \
+                   not (destpath + os.sep).startswith(destdir + os.sep):
+                    raise Exception('Invalid path "%s" in "%s"' % \
+                                    (info.filename, f))
+                # create the directories first, so that members can be
+                # extracted in any order
+                if info.filename.endswith('/'):
+                    parent = destpath
+                else:
+                    parent = os.path.dirname(destpath)
+                    members.append((info, destpath))
+                if not os.path.isdir(parent):
                     os.makedirs(parent)
-                fh = open(destpath, 'w')
-                fh.write(zf.read(name))
-                fh.close()
-        zf.close()
+            extract = lambda m: _extract_member(zf, m[0], m[1], chunk_size)
+            if workers > 1 and len(members) > 1:
+                parallel_map(extract, members, workers)
+            else:
+                for m in members:
+                    extract(m)
+        finally:
+            if close:
+                zf.close()
     except:
         if os.path.exists(destdir):
             import shutil
@@ -98,3 +192,35 @@ def extract_zipfile(f, destdir):
         raise
 
 # }}}
+# _extract_member() {{{
+
+def _extract_member(zf, info, destpath, chunk_size):
+    """
+    Stream the member described by the ZipInfo 'info' of the zip file 'zf'
+    to 'destpath' and check its CRC.
+    """
+    import os
+    import zlib
+    src = zf.open(info)
+    try:
+        fh = open(destpath, 'wb')
+        try:
+            crc = 0
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                fh.write(chunk)
+        finally:
+            fh.close()
+    finally:
+        src.close()
+    if crc & 0xffffffff != info.CRC:
+        raise Exception('Bad CRC for "%s"' % info.filename)
+    # unix permissions are in the high bits of the external attributes
+    mode = (info.external_attr >> 16) & 0777
+    if mode:
+        os.chmod(destpath, mode)
+
+# }}}
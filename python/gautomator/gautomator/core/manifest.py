@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2007 David JL <izimobil@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# $Id$
+
+"""
+Manifests of the inputs processed by workflows, used by incremental runs.
+"""
+
+__version__ = '$Revision$'
+__author__  = 'David JEAN LOUIS <izimobil@gmail.com>'
+__all__     = ['Manifest']
+
+# dependencies {{{
+
+import os
+import threading
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from gautomator.core import settings
+
+# }}}
+# class Manifest {{{
+
+class Manifest:
+    """
+    Record the (size, mtime, inode) of every file fed to a workflow so that
+    the next incremental run only processes new or modified files.
+    """
+    VERSION = 1
+
+    def __init__(self, workflow_name):
+        """
+        Constructor, load the manifest of the given workflow.
+        """
+        fname = '%s.manifest' % workflow_name.replace(os.sep, '_')
+        self.path = os.path.join(settings.get_user_workflows_dir(), fname)
+        self.entries = {}
+        self.seen = {}
+        try:
+            fh = open(self.path, 'rb')
+            try:
+                version, entries = pickle.load(fh)
+            finally:
+                fh.close()
+            if version == self.VERSION:
+                self.entries = entries
+        except Exception, exc:
+            pass
+
+    def filter(self, items):
+        """
+        Generator yielding the given items that changed since the manifest
+        was saved. Directories are walked recursively and only their changed
+        files are yielded, items that are not file paths are always yielded.
+        """
+        for item in items:
+            if not isinstance(item, basestring) or not os.path.exists(item):
+                yield item
+            elif os.path.isdir(item):
+                for root, dirs, files in os.walk(item):
+                    dirs.sort()
+                    files.sort()
+                    for f in files:
+                        path = os.path.join(root, f)
+                        if self._changed(path):
+                            yield path
+            elif self._changed(item):
+                yield item
+
+    def save(self):
+        """
+        Save the state of all the files seen by filter() as the new manifest,
+        files not seen anymore are forgotten.
+        """
+        # daemon workers may save the manifest of the same workflow at the
+        # same time, each one needs its own temporary file
+        tmp = '%s.%s.%s' % (self.path, os.getpid(),
+                            threading.currentThread().ident)
+        try:
+            fh = open(tmp, 'wb')
+            try:
+                pickle.dump((self.VERSION, self.seen), fh,
+                            pickle.HIGHEST_PROTOCOL)
+            finally:
+                fh.close()
+            os.rename(tmp, self.path)
+        except:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        self.entries, self.seen = self.seen, {}
+
+    def _changed(self, path):
+        """
+        Record the state of the given file and return True if it is new or
+        was modified.
+        """
+        try:
+            st = os.stat(path)
+        except OSError, exc:
+            return False
+        path = os.path.abspath(path)
+        state = (st.st_size, st.st_mtime, st.st_ino)
+        self.seen[path] = state
+        return self.entries.get(path) != state
+
+# }}}
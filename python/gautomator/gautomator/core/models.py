@@ -28,8 +28,8 @@ gautomator models.
 
 __version__ = '$Revision$'
 __author__  = 'David JEAN LOUIS <izimobil@gmail.com>'
-__all__     = ['Action', 'Author', 'Parameter', 'Input', 'Ouput', 'Category',
-               'Workflow']
+__all__     = ['Action', 'LazyAction', 'Author', 'Parameter', 'Input', 'Ouput',
+               'Category', 'Workflow']
 
 # dependencies {{{
 
@@ -37,6 +37,7 @@ import os
 import sys
 import logging
 import gettext
+import threading
 _ = gettext.gettext
 
 
@@ -63,7 +64,11 @@ class Action:
             'categories' : kwargs.get('categories', []),
             'parameters' : kwargs.get('parameters', []),
             'input'      : kwargs.get('input_', []),
-            'output'     : kwargs.get('output', [])
+            'output'     : kwargs.get('output', []),
+            'parallel'   : kwargs.get('parallel', False),
+            'ordered'    : kwargs.get('ordered', True),
+            'cacheable'  : kwargs.get('cacheable', False),
+            'resource'   : kwargs.get('resource', 'cpu')
         }
 
     def __str__(self):
@@ -82,31 +87,77 @@ class Action:
         Keyword argument:
         action -- object, an instance of Action class or subclass
         """
-        return True
+        from gautomator.core.controllers import ActionManager
+        return ActionManager.can_chain(action, self)
 
-    def run(self, *args):
+    def run(self, *args, **kwargs):
         """
-        Method that actually perform the action, the default is to return
-        the input data untouched.
+        Method that actually perform the action on one input item and return
+        an iterable of output items, the default is to return the input data
+        untouched. The keyword arguments are the action parameters values.
         """
         return args
 
+    def process(self, items, **kwargs):
+        """
+        Generator that processes a stream of input items and yields output
+        items. The default calls run() on each item, actions that produce
+        items without input, or need the whole stream, override this method.
+        """
+        for item in items:
+            for ret in self.run(item, **kwargs):
+                yield ret
+
     @classmethod
     def new(cls, xml):
-        authors = [Author.new(n) for n in xml.findall('authors/author')]
-        cats = []
+        """
+        Build an action instance from the given xml node.
+        """
+        return cls.from_info(cls.parse_info(xml))
+
+    @classmethod
+    def from_info(cls, info):
+        """
+        Build an action instance from the dict returned by parse_info().
+        """
         from gautomator.core.controllers import CategoryManager
-        for node in xml.findall('categories/category'):
-            cat = CategoryManager.get(node.text.strip())
+        kwargs = dict(info)
+        kwargs['categories'] = []
+        for name in info['categories']:
+            cat = CategoryManager.get(name)
             if cat is not None:
-                cats.append(cat)
+                kwargs['categories'].append(cat)
+        return cls(**kwargs)
+
+    @staticmethod
+    def parse_info(xml):
+        """
+        Parse the given xml node and return a dict of constructor keyword
+        arguments. Categories are returned as names so that the dict can be
+        pickled and stored in the action registry index.
+        """
+        authors = [Author.new(n) for n in xml.findall('authors/author')]
+        cats = [n.text.strip() for n in xml.findall('categories/category')]
         params = [Parameter.new(n) for n in xml.findall('parameters/parameter')]
         input_ = Input.new(xml.find('input'))
         output = Output.new(xml.find('output'))
         icon   = xml.findtext('icon').strip()
         if icon is None or icon == '':
             icon = 'applications-system'
-        return cls(
+        # <parallel ordered="false">items</parallel> means that input items
+        # are independent and can be processed concurrently
+        node = xml.find('parallel')
+        parallel = node is not None and \
+            (node.text or '').strip().lower() == 'items'
+        ordered = node is None or \
+            node.attrib.get('ordered', 'true').lower() not in ('0', 'false')
+        # <cacheable>true</cacheable> means that the action outputs only
+        # depend on its input item and parameters values
+        cacheable = xml.findtext('cacheable', '').strip().lower() in \
+            ('1', 'true')
+        # resource class used by the scheduler: cpu, io or network
+        resource = xml.findtext('resource', 'cpu').strip().lower() or 'cpu'
+        return dict(
             id_         = xml.attrib.get('id'),
             name        = xml.findtext('name').strip(),
             icon        = icon,
@@ -116,16 +167,117 @@ class Action:
             categories  = cats,
             parameters  = params,
             input_      = input_,
-            output      = output
+            output      = output,
+            parallel    = parallel,
+            ordered     = ordered,
+            cacheable   = cacheable,
+            resource    = resource
         )
 
 
 # }}}
-# Action class {{{
+# LazyAction class {{{
+
+class LazyAction(Action):
+    """
+    Proxy for an action whose module has not been imported yet. It only
+    carries the action metadata, the action module is imported and the real
+    UserAction instance built the first time it is needed.
+    """
+    _lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        """
+        Constructor, the 'path' keyword argument is the action directory.
+        """
+        Action.__init__(self, *args, **kwargs)
+        self.path = kwargs.get('path')
+        self._action = None
+
+    def __getattr__(self, name):
+        """
+        Forward unknown attributes to the real action.
+        """
+        if name.startswith('__') or name == '_action':
+            raise AttributeError(name)
+        return getattr(self.get_action(), name)
+
+    def get_action(self):
+        """
+        Import the action module if needed and return the real action.
+        """
+        if self._action is None:
+            self._lock.acquire()
+            try:
+                if self._action is None:
+                    action_id = os.path.basename(self.path)
+                    zipped = action_id.endswith('.zip')
+                    if zipped:
+                        action_id = action_id[:-4]
+                    mod = sys.modules.get(action_id)
+                    if mod is None and zipped:
+                        mod = _load_zipped_package(action_id, self.path)
+                    elif mod is None:
+                        import imp
+                        fh, path, desc = imp.find_module(action_id,
+                            [os.path.dirname(self.path)])
+                        try:
+                            mod = imp.load_module(action_id, fh, path, desc)
+                        finally:
+                            if fh is not None:
+                                fh.close()
+                    action = mod.UserAction()
+                    action.info = self.info
+                    self._action = action
+            finally:
+                self._lock.release()
+        return self._action
+
+    def run(self, *args, **kwargs):
+        """
+        See Action.run().
+        """
+        return self.get_action().run(*args, **kwargs)
+
+    def process(self, items, **kwargs):
+        """
+        See Action.process().
+        """
+        return self.get_action().process(items, **kwargs)
+
+
+# }}}
+# _load_zipped_package() {{{
+
+def _load_zipped_package(name, path):
+    """
+    Import the zip file 'path', that has an __init__.py file at its root, as
+    the package 'name'. Since the archive is the package path, the modules of
+    the package are imported from the archive too.
+    """
+    import imp
+    import zipimport
+    importer = zipimport.zipimporter(path)
+    mod = imp.new_module(name)
+    mod.__file__ = os.path.join(path, '__init__.py')
+    mod.__path__ = [path]
+    mod.__loader__ = importer
+    sys.modules[name] = mod
+    try:
+        exec importer.get_code('__init__') in mod.__dict__
+    except:
+        del sys.modules[name]
+        raise
+    return mod
+
+# }}}
+# Workflow class {{{
 
 class Workflow:
     """
-    Base class for all gautomator actions.
+    A workflow is a directed acyclic graph of actions, each action processing
+    the output of the actions linked to it. As long as no link is explicitly
+    set with connect(), actions are chained in the order they were appended.
     """
 
     def __init__(self, *args, **kwargs):
@@ -134,20 +286,84 @@ class Workflow:
         """
         self.name = kwargs.get('name')
         self.actions = []
+        self.parameters = []
+        self.links = []
+        self.workers = kwargs.get('workers')
+        self._cancel_event = threading.Event()
 
     def __str__(self):
         """
-        String representation of the action.
+        String representation of the workflow.
         """
         return self.name
 
-    def run(self, *args):
+    def append(self, action, params=None):
         """
-        Method that actually perform the action, the default is to return
-        the input data untouched.
+        Append the given action to the workflow and return its index, params
+        is a dict of values for the action parameters.
         """
-        for action in self.actions:
-            yield action.run()
+        self.actions.append(action)
+        self.parameters.append(params or {})
+        return len(self.actions) - 1
+
+    def connect(self, src, dst):
+        """
+        Feed the output of the action at index src to the action at index dst.
+        An action can feed several actions and be fed by several actions.
+        """
+        if (src, dst) not in self.links:
+            self.links.append((src, dst))
+
+    def get_links(self):
+        """
+        Return the list of (src, dst) links of the workflow, the implicit
+        chain if no link was set.
+        """
+        if self.links:
+            return list(self.links)
+        return [(i, i+1) for i in range(len(self.actions)-1)]
+
+    def cancel(self):
+        """
+        Ask the running workflow to stop, the current item is completed and
+        run() returns before the next one is processed.
+        """
+        self._cancel_event.set()
+
+    def run(self, *args, **kwargs):
+        """
+        Run the workflow with the given input items and yield the items
+        produced by the last actions as soon as they are available.
+        Independent branches of the workflow run concurrently.
+        Actions declared as item parallel are run by a pool of 'workers'
+        processes (the number of CPUs by default, 1 disables it).
+        If the 'incremental' keyword argument is True, only the input files
+        (folders are walked) that are new or were modified since the last
+        complete incremental run are processed.
+        Actions are run under the control of the 'scheduler' keyword argument
+        (the default scheduler if not given) with the given 'priority'
+        (defaults to 0, higher priorities are served first).
+        """
+        from gautomator.core import engine
+        from gautomator.core import scheduler
+        self._cancel_event.clear()
+        steps = zip(self.actions, self.parameters)
+        items = args
+        if kwargs.get('incremental'):
+            from gautomator.core.manifest import Manifest
+            manifest = Manifest(self.name)
+            items = manifest.filter(args)
+        try:
+            for item in engine.run_graph(steps, self.get_links(), items,
+                    self._cancel_event, self.workers,
+                    kwargs.get('scheduler') or scheduler.get_default(),
+                    kwargs.get('priority', 0)):
+                yield item
+        except engine.Cancelled:
+            logging.debug('workflow "%s" cancelled' % self.name)
+            return
+        if kwargs.get('incremental'):
+            manifest.save()
 
 # }}}
 # Parameter class {{{
@@ -239,12 +455,17 @@ class _IOBase:
         """
         Load instance from given xml node.
         """
-        mimetypes = [m.text.strip() for m in xml.findall('mimetypes')]
-        try:
-            type_ = xml.attrib.get('type', 'FilesAndFolders').strip().upper()
-            type_ = getattr(self, 'TYPE_%s' % type_)
-        except:
-            type_ = None
+        if xml is None:
+            return cls()
+        mimetypes = [m.text.strip() for m in xml.findall('mimetype')
+                     if m.text and m.text.strip()]
+        # the type is the name of a gautomator.core.types class, for
+        # example "TypeFilesAndFolders"
+        type_ = xml.attrib.get('type', 'FilesAndFolders').strip()
+        if type_.startswith('Type'):
+            type_ = type_[4:]
+        type_ = getattr(cls, 'TYPE_%s' % type_.upper(),
+                        cls.TYPE_FILESANDFOLDERS)
         return cls(type_=type_, mimetypes=mimetypes)
 
 # }}}
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2007 David JL <izimobil@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# $Id$
+
+"""
+Resource scheduler for gautomator.
+
+Each action declares in its action.xml the resource it mostly uses:
+
+    <resource>cpu|io|network</resource>
+
+and each resource class has a concurrency limit shared by all the workflows
+running in the process. An action holds a slot of its resource class while
+it processes an item, slots are granted to the highest priority waiter first
+(first come first served between equal priorities).
+"""
+
+__version__ = '$Revision$'
+__author__  = 'David JEAN LOUIS <izimobil@gmail.com>'
+__all__     = ['RESOURCES', 'Scheduler', 'get_default', 'parse_limits']
+
+# dependencies {{{
+
+import time
+import heapq
+import itertools
+import threading
+
+# }}}
+# constants {{{
+
+RESOURCES = ['cpu', 'io', 'network']
+
+# }}}
+# class Scheduler {{{
+
+class Scheduler:
+    """
+    Grant slots of resource classes according to their concurrency limits
+    and to the priority of the requesters.
+    """
+
+    def __init__(self, limits=None):
+        """
+        Constructor, limits is a dict mapping resource classes to their
+        maximum number of concurrent slots, missing classes use the default
+        limits.
+        """
+        from gautomator.core.engine import cpu_count
+        self.limits = {'cpu': cpu_count(), 'io': 4, 'network': 8}
+        self.limits.update(limits or {})
+        self.running = dict((r, 0) for r in self.limits)
+        self.waiters = dict((r, []) for r in self.limits)
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+
+    def acquire(self, resource, priority=0, timeout=None):
+        """
+        Block until a slot of the given resource class is granted, higher
+        priorities are served first. If timeout is not None, give up after
+        'timeout' seconds. Return True if the slot was granted.
+        """
+        if resource not in self.limits:
+            resource = 'cpu'
+        if timeout is not None:
+            deadline = time.time() + timeout
+        self.cond.acquire()
+        try:
+            waiters = self.waiters[resource]
+            ticket = (-priority, self.counter.next())
+            heapq.heappush(waiters, ticket)
+            while waiters[0] != ticket or \
+                  self.running[resource] >= self.limits[resource]:
+                if timeout is None:
+                    self.cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    waiters.remove(ticket)
+                    heapq.heapify(waiters)
+                    # the next waiter may be first now
+                    self.cond.notifyAll()
+                    return False
+                self.cond.wait(remaining)
+            heapq.heappop(waiters)
+            self.running[resource] += 1
+            # the next waiter may also be able to run
+            self.cond.notifyAll()
+            return True
+        finally:
+            self.cond.release()
+
+    def release(self, resource):
+        """
+        Release a slot of the given resource class.
+        """
+        if resource not in self.limits:
+            resource = 'cpu'
+        self.cond.acquire()
+        try:
+            self.running[resource] -= 1
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+# }}}
+# get_default() {{{
+
+_default = []
+
+def get_default():
+    """
+    Return the scheduler shared by all the workflows of the process.
+    """
+    if not _default:
+        _default.append(Scheduler())
+    return _default[0]
+
+# }}}
+# parse_limits() {{{
+
+def parse_limits(s):
+    """
+    Parse a string like "cpu=4,io=2" and return the corresponding dict,
+    ValueError is raised if the string is not valid.
+    """
+    ret = {}
+    for part in [p.strip() for p in s.split(',') if p.strip()]:
+        resource, limit = part.split('=')
+        if resource.strip() not in RESOURCES or int(limit) < 1:
+            raise ValueError('invalid resource limit "%s"' % part)
+        ret[resource.strip()] = int(limit)
+    return ret
+
+# }}}
@@ -33,7 +33,6 @@ __author__  = 'David JEAN LOUIS <izimobil@gmail.com>'
 
 import os
 import sys
-import tempfile
 
 # }}}
 # get_resource_dir() {{{
@@ -74,6 +73,24 @@ def get_user_actions_dir():
     """
     return os.path.join(os.path.expanduser('~'), '.gautomator', 'actions')
 
+# }}}
+# get_action_registry_filepath() {{{
+
+def get_action_registry_filepath():
+    """
+    Return the path to the file used to store the action registry index.
+    """
+    return os.path.join(os.path.expanduser('~'), '.gautomator', 'actions.idx')
+
+# }}}
+# get_cache_dir() {{{
+
+def get_cache_dir():
+    """
+    Return the directory containing the action results cache.
+    """
+    return os.path.join(os.path.expanduser('~'), '.gautomator', 'cache')
+
 # }}}
 # get_builtin_workflows_dir() {{{
 
@@ -97,8 +114,16 @@ def get_user_workflows_dir():
 
 def get_named_pipe_filepath():
     """
-    Return the path to the named pipe used for IPC.
+    Return the path to the named pipe used for IPC. It lives in the user
+    runtime directory ($XDG_RUNTIME_DIR) or, if there is none, in a
+    gautomator-<uid> directory of the temporary directory, which must only
+    be accessible by the user.
     """
-    return os.path.join(tempfile.gettempdir(), 'gautomator.pipe')
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if not runtime_dir:
+        import tempfile
+        runtime_dir = os.path.join(tempfile.gettempdir(),
+                                   'gautomator-%d' % os.getuid())
+    return os.path.join(runtime_dir, 'gautomator.pipe')
 
 # }}}
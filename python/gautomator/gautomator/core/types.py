@@ -32,14 +32,32 @@ __all__     = ['Type', 'TypeNull', 'TypeFilesAndFolders', 'TypeData']
 
 # dependencies {{{
 
-import mimetypes
 import gettext
 from gautomator.core.helpers import uniq
 
 _ = gettext.gettext
-mimetypes.init()
 
 #}}}
+# _SystemMimetypes class {{{
+
+class _SystemMimetypes(object):
+    """
+    Descriptor returning the sorted list of all the mimetypes known by the
+    system, the mime database is only read the first time it is accessed.
+    """
+    def __init__(self, *extra):
+        self.extra = list(extra)
+        self.value = None
+
+    def __get__(self, obj, objtype=None):
+        if self.value is None:
+            import mimetypes
+            mimetypes.init()
+            self.value = uniq(self.extra + mimetypes.types_map.values() + \
+                mimetypes.common_types.values(), True)
+        return self.value
+
+# }}}
 # Type class {{{
 
 class Type(object):
@@ -71,8 +89,7 @@ class TypeFilesAndFolders(Type):
     """
     Handle files and folders recursively.
     """
-    mimetypes = uniq(['inode/directory'] + \
-        mimetypes.types_map.values() + mimetypes.common_types.values(), True)
+    mimetypes = _SystemMimetypes('inode/directory')
 
     def __str__(self):
         return _('Files and folders')
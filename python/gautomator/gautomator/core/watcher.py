@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2007 David JL <izimobil@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# $Id$
+
+"""
+Watcher of the actions directories.
+
+The watcher thread applies the changes of the builtin and user actions
+directories to the loaded action registry (see ActionManager.refresh()) as
+soon as they happen, using inotify on Linux and polling elsewhere.
+Every file of the action packages is watched, not only action.xml, so that
+the modules of an action whose code changed are reloaded.
+"""
+
+__version__ = '$Revision$'
+__author__  = 'David JEAN LOUIS <izimobil@gmail.com>'
+__all__     = ['Watcher']
+
+# dependencies {{{
+
+import os
+import errno
+import select
+import struct
+import logging
+import threading
+
+from gautomator.core import settings
+
+# }}}
+# constants {{{
+
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED     = 0x00008000
+IN_ISDIR       = 0x40000000
+
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+             IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+# }}}
+# class Watcher {{{
+
+class Watcher(threading.Thread):
+    """
+    Thread keeping the action registry up to date. The callback, if any, is
+    called from the watcher thread with the (added, updated, removed) lists
+    returned by ActionManager.refresh() when something changed.
+    """
+
+    def __init__(self, callback=None, interval=2.0, delay=0.2):
+        """
+        Constructor, interval is the polling interval used when inotify is
+        not available and delay the time events are accumulated before the
+        registry is refreshed, so that an action being copied is read once.
+        """
+        threading.Thread.__init__(self, name='gautomator-watcher')
+        self.setDaemon(True)
+        self.callback = callback
+        self.interval = interval
+        self.delay = delay
+        self.dirs = [settings.get_builtin_actions_dir(),
+                     settings.get_user_actions_dir()]
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """
+        Ask the watcher thread to stop.
+        """
+        self._stop_event.set()
+
+    def run(self):
+        """
+        Thread main loop.
+        """
+        try:
+            inotify = _Inotify()
+        except (OSError, AttributeError), exc:
+            logging.debug('inotify not available (%s), polling' % exc)
+            inotify = None
+        try:
+            if inotify is not None:
+                self._watch(inotify)
+            else:
+                self._poll()
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+    def _poll(self):
+        """
+        Rescan the actions directories every 'interval' seconds.
+        """
+        snapshot = self._scan()
+        while not self._stop_event.isSet():
+            self._stop_event.wait(self.interval)
+            if self._stop_event.isSet():
+                break
+            current = self._scan()
+            changed = [p for p in set(snapshot) | set(current)
+                       if snapshot.get(p) != current.get(p)]
+            snapshot = current
+            if changed:
+                self._refresh(changed)
+
+    def _scan(self):
+        """
+        Return a dict mapping the entries of the actions directories to
+        their stamp (see _get_stamp()).
+        """
+        ret = {}
+        for d in self.dirs:
+            try:
+                names = os.listdir(d)
+            except OSError, exc:
+                continue
+            for name in names:
+                if not name.startswith('.'):
+                    path = os.path.join(d, name)
+                    ret[path] = _get_stamp(path)
+        return ret
+
+    def _watch(self, inotify):
+        """
+        Refresh the actions reported by inotify.
+        """
+        # maps watch descriptors to (directory, action directory), the
+        # action directory is None for the actions directories themselves
+        watches = {}
+        def add_watch(path, action_dir):
+            try:
+                watches[inotify.add_watch(path, WATCH_MASK)] = \
+                    (path, action_dir)
+            except OSError, exc:
+                logging.debug('unable to watch "%s": %s' % (path, exc))
+                return
+            if action_dir is None:
+                return
+            # subdirectories of action packages are watched too
+            try:
+                names = os.listdir(path)
+            except OSError, exc:
+                return
+            for name in names:
+                sub = os.path.join(path, name)
+                if not name.startswith('.') and os.path.isdir(sub) and \
+                   not os.path.islink(sub):
+                    add_watch(sub, action_dir)
+        for d in self.dirs:
+            add_watch(d, None)
+            for name in os.listdir(d):
+                if os.path.isdir(os.path.join(d, name)):
+                    add_watch(os.path.join(d, name), os.path.join(d, name))
+        changed = set()
+        while not self._stop_event.isSet():
+            # wait for events, then for the burst of events to end
+            timeout = changed and self.delay or 0.5
+            events = inotify.read(timeout)
+            if not events and changed:
+                self._refresh(list(changed))
+                changed = set()
+                continue
+            for wd, mask, name in events:
+                if wd not in watches:
+                    continue
+                path, action_dir = watches[wd]
+                if mask & IN_IGNORED:
+                    del watches[wd]
+                    continue
+                if name and (name.startswith('.') or name.endswith('.pyc')
+                             or name.endswith('.pyo')):
+                    # hidden and compiled files are not part of the action
+                    continue
+                created = name and mask & IN_ISDIR and \
+                          mask & (IN_CREATE | IN_MOVED_TO)
+                if action_dir is not None:
+                    # a file of an action package changed
+                    changed.add(action_dir)
+                    if created:
+                        add_watch(os.path.join(path, name), action_dir)
+                elif name:
+                    # an action directory or zip file was added, removed or
+                    # replaced
+                    changed.add(os.path.join(path, name))
+                    if created:
+                        add_watch(os.path.join(path, name),
+                                  os.path.join(path, name))
+
+    def _refresh(self, paths):
+        """
+        Refresh the registry and call the callback if something changed.
+        """
+        from gautomator.core.controllers import ActionManager
+        try:
+            added, updated, removed = ActionManager.refresh(paths)
+        except Exception, exc:
+            logging.warning('unable to refresh the action registry: %s' % exc)
+            return
+        if (added or updated or removed) and self.callback is not None:
+            self.callback(added, updated, removed)
+
+# }}}
+# _get_stamp() {{{
+
+def _get_stamp(path):
+    """
+    Return a tuple that changes whenever a file of the given action
+    directory or zip file is added, removed or modified: the inode of the
+    path, the newest mtime, the number and the total size of the files.
+    Hidden and compiled python files are ignored, the latter are written
+    when the action is imported.
+    """
+    try:
+        st = os.stat(path)
+    except OSError, exc:
+        return None
+    if not os.path.isdir(path):
+        return (st.st_ino, st.st_mtime, st.st_size)
+    newest = count = size = 0
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for f in files:
+            if f.startswith('.') or f.endswith('.pyc') or f.endswith('.pyo'):
+                continue
+            try:
+                fst = os.stat(os.path.join(root, f))
+            except OSError, exc:
+                continue
+            newest = max(newest, fst.st_mtime)
+            count += 1
+            size += fst.st_size
+    return (st.st_ino, newest, count, size)
+
+# }}}
+# class _Inotify {{{
+
+class _Inotify:
+    """
+    Minimal inotify binding, OSError is raised if inotify is not available.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                                use_errno=True)
+        self.errno = ctypes.get_errno
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(self.errno(), 'inotify_init failed')
+
+    def add_watch(self, path, mask):
+        """
+        Watch the given path and return the watch descriptor.
+        """
+        wd = self.libc.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            err = self.errno()
+            raise OSError(err, os.strerror(err))
+        return wd
+
+    def read(self, timeout):
+        """
+        Return the list of (watch descriptor, mask, name) events read within
+        'timeout' seconds.
+        """
+        try:
+            ready = select.select([self.fd], [], [], timeout)[0]
+        except select.error, exc:
+            if exc[0] == errno.EINTR:
+                return []
+            raise
+        if not ready:
+            return []
+        data = os.read(self.fd, 65536)
+        events = []
+        pos = 0
+        while pos + 16 <= len(data):
+            wd, mask, cookie, size = struct.unpack('iIII', data[pos:pos+16])
+            name = data[pos+16:pos+16+size].rstrip('\0')
+            events.append((wd, mask, name))
+            pos += 16 + size
+        return events
+
+    def close(self):
+        """
+        Release the inotify file descriptor.
+        """
+        os.close(self.fd)
+
+# }}}
@@ -58,6 +58,7 @@ import pygtk; pygtk.require("2.0")
 import gtk
 import gtk.glade
 import logging
+import threading
 try:
     import cPickle as pickle
 except ImportError:
@@ -66,6 +67,7 @@ except ImportError:
 from gautomator.core import controllers
 from gautomator.core import models
 from gautomator.core import settings
+from gautomator.core import watcher
 
 # }}}
 # Constants {{{
@@ -80,6 +82,7 @@ gettext.textdomain(APP_NAME)
 gettext.bindtextdomain(APP_NAME)
 gtk.glade.textdomain(APP_NAME)
 gtk.glade.bindtextdomain(APP_NAME)
+gobject.threads_init()
 
 # }}}
 # MainWindow class {{{
@@ -96,6 +99,8 @@ class MainWindow(object):
         """
         self.id= 0
         self.current_action = None
+        self.current_workflow = None
+        self.workflow_name = None
         # init glade interface
         logging.debug('initializing glade interface')
         self.glade = gtk.glade.XML(
@@ -126,6 +131,10 @@ class MainWindow(object):
         self.label_action_desc = self.glade.get_widget('label_action_desc')
         self.image_action_icon = self.glade.get_widget('image_action_icon')
         self.button_search = self.glade.get_widget('button_search')
+        self.button_play = self.glade.get_widget('button_play_workflow')
+        self.button_stop = self.glade.get_widget('button_stop_workflow')
+        self.statusbar = self.glade.get_widget('statusbar1')
+        self.button_stop.set_sensitive(False)
         self.hpaned = self.glade.get_widget('hpaned1')
         self.tv_categories = self.init_categories_treeview()
         self.tv_actions = self.init_actions_treeview()
@@ -146,6 +155,12 @@ class MainWindow(object):
             self.on_drag_data_received
         )
         self.tv_workflow.connect('drag-motion', self.on_drag_motion)
+        # keep the actions list up to date when actions are installed,
+        # updated or removed while the application runs
+        controllers.ActionManager.get_all()
+        self.watcher = watcher.Watcher(
+            lambda *args: gobject.idle_add(self.on_actions_changed, *args))
+        self.watcher.start()
 
     # }}}
     # MainWindow::init() {{{
@@ -250,16 +265,7 @@ class MainWindow(object):
         logging.debug('entering method MainWindow::on_drag_data_received()')
         model  = w.get_model()
         drop_info = w.get_dest_row_at_pos(x, y)
-        try:
-            theme = gtk.icon_theme_get_default()
-            pb = theme.load_icon(self.current_action.info['icon'],
-                48, gtk.ICON_LOOKUP_USE_BUILTIN)
-        except:
-            # do not fail if icon is not found, just create a 1px pixbuf
-            pb = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB, True, 8, 1, 1)
-        label = "<b>%s</b>\n%s" % \
-            (self.current_action.info['name'],
-             self.current_action.info['description'])
+        row = self._get_workflow_row(self.current_action)
         if drop_info:
             path, pos = drop_info
             iter = model.get_iter(path)
@@ -268,9 +274,9 @@ class MainWindow(object):
                 method = 'insert_before'
             else:
                 method = 'insert_after'
-            getattr(model, method)(iter, [self.current_action, pb, label])
+            getattr(model, method)(iter, row)
         else:
-            model.append([self.current_action, pb, label])
+            model.append(row)
         if ctx.get_source_widget() == w:
             ctx.finish(True, True, t)
 
@@ -332,14 +338,8 @@ class MainWindow(object):
             return
         theme = gtk.icon_theme_get_default()
         self.tv_actions.get_model().clear()
-        for i, act in enumerate(controllers.ActionManager.get_by_category(cat)):
-            try:
-                pb = theme.load_icon(act.info['icon'], 16,
-                    gtk.ICON_LOOKUP_USE_BUILTIN)
-            except:
-                # do not fail if icon is not found, just create a 1px pixbuf
-                pb = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB, True, 8, 1, 1)
-            self.tv_actions.get_model().append([act, pb, act.info['name']])
+        for act in controllers.ActionManager.get_by_category(cat):
+            self.tv_actions.get_model().append(self._get_action_row(act))
         self.label_action_name.set_markup('<big><b>%s</b></big>' % cat.name)
         self.label_action_desc.set_text(cat.description)
         try:
@@ -350,6 +350,44 @@ class MainWindow(object):
         self.image_action_icon.set_from_pixbuf(caticon)
         self._fix_description_label_wrapping()
 
+    # }}}
+    # MainWindow::on_actions_changed() {{{
+
+    def on_actions_changed(self, added, updated, removed):
+        """
+        Callback called when the action registry changed, the rows of the
+        actions treeview are updated in place.
+        """
+        logging.debug('entering method MainWindow::on_actions_changed()')
+        try:
+            treemodel, it = self.tv_categories.get_selection().get_selected()
+            cat = treemodel.get(it, 0)[0]
+        except:
+            cat = None
+        model = self.tv_actions.get_model()
+        changed = dict([(a.path, a) for a in updated])
+        gone = set([a.path for a in removed])
+        it = model.get_iter_first()
+        while it is not None:
+            act = model.get_value(it, 0)
+            if act.path in gone or \
+               (act.path in changed and not self._in_category(
+                   changed[act.path], cat)):
+                if not model.remove(it):
+                    it = None
+                continue
+            if act.path in changed:
+                row = self._get_action_row(changed.pop(act.path))
+                for col, value in enumerate(row):
+                    model.set_value(it, col, value)
+            it = model.iter_next(it)
+        # new actions, and updated ones that moved to this category
+        for act in added + changed.values():
+            if self._in_category(act, cat):
+                model.append(self._get_action_row(act))
+        self._set_status(_('%d action(s) added, %d updated, %d removed') % \
+            (len(added), len(updated), len(removed)))
+
     # }}}
     # MainWindow::on_action_selected() {{{
 
@@ -409,6 +447,7 @@ class MainWindow(object):
         workflow.
         """
         logging.debug('entering method MainWindow::on_new_workflow()')
+        self.tv_workflow.get_model().clear()
 
     # }}}
     # MainWindow::on_open_workflow() {{{
@@ -419,6 +458,46 @@ class MainWindow(object):
         workflow.
         """
         logging.debug('entering method MainWindow::on_open_workflow()')
+        dialog = gtk.Dialog(_('Open workflow'), self.window,
+            gtk.DIALOG_MODAL | gtk.DIALOG_DESTROY_WITH_PARENT,
+            (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL,
+             gtk.STOCK_OPEN, gtk.RESPONSE_OK))
+        dialog.set_default_size(400, 300)
+        tv = gtk.TreeView(gtk.ListStore(str, str))
+        tv.append_column(gtk.TreeViewColumn(_('Workflows'),
+            gtk.CellRendererText(), markup=1))
+        # list the workflows from the index, files are not opened
+        for wf in controllers.WorkflowManager.get_all():
+            tv.get_model().append([wf['path'], '<b>%s</b>\n%s' % (
+                gobject.markup_escape_text(wf['name']),
+                _('%d actions') % len(wf['actions']))])
+        tv.connect('row-activated',
+            lambda *args: dialog.response(gtk.RESPONSE_OK))
+        sw = gtk.ScrolledWindow()
+        sw.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        sw.add(tv)
+        dialog.vbox.pack_start(sw)
+        dialog.show_all()
+        try:
+            if dialog.run() != gtk.RESPONSE_OK:
+                return
+            model, it = tv.get_selection().get_selected()
+            if it is None:
+                return
+            try:
+                workflow = controllers.WorkflowManager.load(
+                    model.get_value(it, 0))
+            except Exception, exc:
+                self._set_status(_('Unable to open workflow: %s') % exc)
+                return
+            self.tv_workflow.get_model().clear()
+            for action in workflow.actions:
+                self.tv_workflow.get_model().append(
+                    self._get_workflow_row(action))
+            self.workflow_name = workflow.name
+            self._set_status(_('Workflow "%s" opened') % workflow.name)
+        finally:
+            dialog.destroy()
 
     # }}}
     # MainWindow::on_save_workflow() {{{
@@ -429,6 +508,32 @@ class MainWindow(object):
         workflow.
         """
         logging.debug('entering method MainWindow::on_save_workflow()')
+        dialog = gtk.Dialog(_('Save workflow'), self.window,
+            gtk.DIALOG_MODAL | gtk.DIALOG_DESTROY_WITH_PARENT,
+            (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL,
+             gtk.STOCK_SAVE, gtk.RESPONSE_OK))
+        entry = gtk.Entry()
+        entry.set_text(self.workflow_name or '')
+        entry.set_activates_default(True)
+        dialog.set_default_response(gtk.RESPONSE_OK)
+        dialog.vbox.pack_start(gtk.Label(_('Workflow name:')))
+        dialog.vbox.pack_start(entry)
+        dialog.show_all()
+        try:
+            if dialog.run() != gtk.RESPONSE_OK or not entry.get_text():
+                return
+            workflow = models.Workflow(name=entry.get_text())
+            for row in self.tv_workflow.get_model():
+                workflow.append(row[0])
+            try:
+                controllers.WorkflowManager.save(workflow)
+            except Exception, exc:
+                self._set_status(_('Unable to save workflow: %s') % exc)
+                return
+            self.workflow_name = workflow.name
+            self._set_status(_('Workflow "%s" saved') % workflow.name)
+        finally:
+            dialog.destroy()
 
     # }}}
     # MainWindow::on_play_workflow() {{{
@@ -439,6 +544,21 @@ class MainWindow(object):
         current workflow.
         """
         logging.debug('entering method MainWindow::on_play_workflow()')
+        if self.current_workflow is not None:
+            return
+        workflow = models.Workflow(
+            name=self.workflow_name or _('Untitled workflow'))
+        for row in self.tv_workflow.get_model():
+            workflow.append(row[0])
+        if not len(workflow.actions):
+            return
+        self.current_workflow = workflow
+        self.button_play.set_sensitive(False)
+        self.button_stop.set_sensitive(True)
+        self._set_status(_('Running workflow...'))
+        thread = threading.Thread(target=self._run_workflow, args=(workflow,))
+        thread.setDaemon(True)
+        thread.start()
 
     # }}}
     # MainWindow::on_stop_workflow() {{{
@@ -449,6 +569,36 @@ class MainWindow(object):
         current workflow.
         """
         logging.debug('entering method MainWindow::on_stop_workflow()')
+        if self.current_workflow is not None:
+            self._set_status(_('Stopping workflow...'))
+            self.current_workflow.cancel()
+
+    # }}}
+    # MainWindow::on_workflow_item() {{{
+
+    def on_workflow_item(self, count, item):
+        """
+        Callback called in the gtk loop each time the running workflow has
+        produced an item.
+        """
+        self._set_status(_('Running workflow... (%d items processed)') % count)
+
+    # }}}
+    # MainWindow::on_workflow_done() {{{
+
+    def on_workflow_done(self, count, exc=None):
+        """
+        Callback called in the gtk loop when the running workflow finished.
+        """
+        logging.debug('entering method MainWindow::on_workflow_done()')
+        self.current_workflow = None
+        self.button_play.set_sensitive(True)
+        self.button_stop.set_sensitive(False)
+        if exc is not None:
+            self._set_status(_('Workflow failed: %s') % exc)
+        else:
+            self._set_status(_('Workflow finished (%d items processed)') % \
+                count)
 
     # }}}
     # MainWindow::on_open_about() {{{
@@ -487,8 +637,73 @@ class MainWindow(object):
         via the window close [x] icon or via the file/quit menu.
         """
         logging.debug('entering method MainWindow::on_quit()')
+        self.watcher.stop()
         gtk.main_quit()
 
+    # }}}
+    # MainWindow::_run_workflow() {{{
+
+    def _run_workflow(self, workflow):
+        # runs in a separate thread, the gtk loop is only updated through
+        # gobject.idle_add()
+        count = 0
+        try:
+            for item in workflow.run():
+                count += 1
+                gobject.idle_add(self.on_workflow_item, count, item)
+        except Exception, exc:
+            logging.exception('workflow failed')
+            gobject.idle_add(self.on_workflow_done, count, exc)
+        else:
+            gobject.idle_add(self.on_workflow_done, count)
+
+    # }}}
+    # MainWindow::_get_action_row() {{{
+
+    def _get_action_row(self, action):
+        try:
+            theme = gtk.icon_theme_get_default()
+            pb = theme.load_icon(action.info['icon'], 16,
+                gtk.ICON_LOOKUP_USE_BUILTIN)
+        except:
+            # do not fail if icon is not found, just create a 1px pixbuf
+            pb = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB, True, 8, 1, 1)
+        return [action, pb, action.info['name']]
+
+    # }}}
+    # MainWindow::_in_category() {{{
+
+    def _in_category(self, action, cat):
+        if cat is None:
+            return False
+        if cat.name.lower() == 'all':
+            return True
+        return cat.name.lower() in \
+            [c.name.lower() for c in action.info['categories']]
+
+    # }}}
+    # MainWindow::_get_workflow_row() {{{
+
+    def _get_workflow_row(self, action):
+        try:
+            theme = gtk.icon_theme_get_default()
+            pb = theme.load_icon(action.info['icon'],
+                48, gtk.ICON_LOOKUP_USE_BUILTIN)
+        except:
+            # do not fail if icon is not found, just create a 1px pixbuf
+            pb = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB, True, 8, 1, 1)
+        label = "<b>%s</b>\n%s" % \
+            (action.info['name'], action.info['description'])
+        return [action, pb, label]
+
+    # }}}
+    # MainWindow::_set_status() {{{
+
+    def _set_status(self, msg):
+        ctx = self.statusbar.get_context_id('workflow')
+        self.statusbar.pop(ctx)
+        self.statusbar.push(ctx, msg)
+
     # }}}
     # MainWindow::_fix_description_label_wrapping() {{{
 
@@ -6,7 +6,7 @@ from gautomator.core.models import Action
 
 # your action class
 class UserAction(Action):
-    def run(self, *args):
+    def run(self, *args, **kwargs):
         # implementation here
         # the default is to return arguments untouched
         return args
@@ -24,7 +24,6 @@
 Jamendo totem plugin (http://www.jamendo.com).
 
 TODO:
-- store thumbnails in relevant XDG directories (?)
 - cleanup the notebook code
 - interface with jamendo write API (not documented yet):
   favorites, comments, etc...
@@ -37,14 +36,24 @@ import gconf
 import gobject
 import gtk
 import gtk.glade
+import hashlib
+import httplib
 import pango
+import Queue
 import socket
+import sys
 import threading
 import time
 import urllib
 import urllib2
+import urlparse
 import webbrowser
+import zlib
 from xml.sax.saxutils import escape
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 try:
     import json
 except ImportError:
@@ -66,6 +75,29 @@ _ = gettext.gettext
 gconf_key = '/apps/totem/plugins/jamendo'
 
 
+def get_cache_home():
+    """
+    Return the base directory of user caches, following the XDG base
+    directory specification.
+    """
+    return os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+
+
+def get_cache_dir():
+    """
+    Return the directory where the plugin caches data.
+    """
+    return os.path.join(get_cache_home(), 'totem', 'jamendo')
+
+
+def get_thumbnails_dir():
+    """
+    Return the directory of the shared "normal" (128x128) thumbnails.
+    """
+    return os.path.join(get_cache_home(), 'thumbnails', 'normal')
+
+
 class JamendoPlugin(totem.Plugin):
     """
     Jamendo totem plugin GUI.
@@ -253,15 +285,9 @@ class JamendoPlugin(totem.Plugin):
 
     def add_treeview_item(self, treeview, album):
         if not isinstance(album['image'], gtk.gdk.Pixbuf):
-            # album image pixbuf is not yet built
-            try:
-                pb = gtk.gdk.pixbuf_new_from_file(album['image'])
-                os.unlink(album['image'])
-                album['image'] = pb
-            except:
-                # do not fail for this, just display a dummy pixbuf
-                album['image'] = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB, True,
-                    8, 1, 1)
+            # the cover could not be decoded, just display a dummy pixbuf
+            album['image'] = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB, True,
+                8, 1, 1)
         # format title
         title  = '<b>%s</b>\n' % self._format_str(album['name'])
         title += _('Artist: %s') % self._format_str(album['artist_name'])
@@ -278,7 +304,8 @@ class JamendoPlugin(totem.Plugin):
             _('Artist: %s') % self._format_str(album['artist_name']),
             _('Genre: %s') % self._format_str(album['genre']),
             _('Released on: %s') % release,
-            _('License: %s') % self._format_str(album['license'][0]),
+            _('License: %s') % self._format_str(album['license'] and \
+                album['license'][0] or ''),
         ])
         # append album row
         parent = treeview.get_model().append(None,
@@ -652,6 +679,411 @@ class JamendoPlugin(totem.Plugin):
             return ''
 
 
+class HTTPClient(object):
+    """
+    Thread safe HTTP client that keeps connections alive, at most
+    'max_per_host' connections are opened to each host.
+    """
+
+    MAX_REDIRECTS = 5
+    USER_AGENT = 'Totem Jamendo plugin'
+    CHUNK_SIZE = 16 * 1024
+
+    def __init__(self, max_per_host=4, timeout=30):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        self.idle = {}
+        self.busy = {}
+
+    def get(self, url, headers=None, callback=None):
+        """
+        Return the body of the given url, urllib2.HTTPError is raised if the
+        server returned an error code and urllib2.URLError if the server
+        could not be reached. See request() for the callback argument.
+        """
+        status, reason, hdrs, body = self.request(url, headers, callback)
+        if status >= 400:
+            raise urllib2.HTTPError(url, status, reason, hdrs, None)
+        return body
+
+    def request(self, url, headers=None, callback=None):
+        """
+        Send a GET request, following redirections, and return a (status,
+        reason, headers, body) tuple, header names are lowercase and the
+        body is decompressed. If a callback is given, the body of a
+        successful response is passed to it chunk by chunk as it arrives
+        instead of being returned.
+        """
+        for i in range(self.MAX_REDIRECTS + 1):
+            status, reason, hdrs, body = self._request(url, headers or {},
+                                                       callback)
+            if status not in (301, 302, 303, 307) or 'location' not in hdrs:
+                return status, reason, hdrs, body
+            url = urlparse.urljoin(url, hdrs['location'])
+        raise urllib2.HTTPError(url, status, 'Too many redirections', hdrs,
+                                None)
+
+    def _request(self, url, headers, callback):
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+        proxy = urllib.getproxies().get(scheme)
+        if proxy and not urllib.proxy_bypass(netloc.split(':')[0]):
+            # proxies get the whole url
+            key = urlparse.urlsplit(proxy)[:2]
+            target = url
+        else:
+            key = (scheme, netloc)
+            target = (path or '/') + (query and '?' + query or '')
+        headers = dict(headers)
+        headers.setdefault('User-Agent', self.USER_AGENT)
+        headers.setdefault('Accept-Encoding', 'gzip')
+        conn, reused = self._acquire(key)
+        try:
+            try:
+                conn.request('GET', target, headers=headers)
+                resp = conn.getresponse()
+            except (httplib.HTTPException, socket.error), exc:
+                if not reused:
+                    raise
+                # the server closed the kept alive connection, retry once
+                conn.close()
+                conn, reused = self._connect(key), False
+                conn.request('GET', target, headers=headers)
+                resp = conn.getresponse()
+            hdrs = dict(resp.getheaders())
+            if callback is not None and 200 <= resp.status < 300:
+                self._stream(resp, hdrs, callback)
+                body = ''
+            else:
+                body = resp.read()
+                if hdrs.get('content-encoding') == 'gzip':
+                    body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        except (httplib.HTTPException, socket.error, zlib.error), exc:
+            conn.close()
+            self._release(key, None)
+            raise urllib2.URLError(exc)
+        except:
+            # the callback failed, the rest of the body is not read
+            conn.close()
+            self._release(key, None)
+            raise
+        if resp.will_close:
+            conn.close()
+            conn = None
+        self._release(key, conn)
+        return resp.status, resp.reason, hdrs, body
+
+    def _stream(self, resp, hdrs, callback):
+        """
+        Pass the decompressed body of the response to callback, chunk by
+        chunk.
+        """
+        if hdrs.get('content-encoding') == 'gzip':
+            decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            decomp = None
+        while True:
+            chunk = resp.read(self.CHUNK_SIZE)
+            if not chunk:
+                break
+            if decomp is not None:
+                chunk = decomp.decompress(chunk)
+            if chunk:
+                callback(chunk)
+        if decomp is not None:
+            chunk = decomp.flush()
+            if chunk:
+                callback(chunk)
+
+    def _acquire(self, key):
+        """
+        Wait for a connection slot to the given (scheme, host) and return a
+        (connection, reused) tuple.
+        """
+        self.cond.acquire()
+        try:
+            while self.busy.get(key, 0) >= self.max_per_host:
+                self.cond.wait()
+            self.busy[key] = self.busy.get(key, 0) + 1
+            if self.idle.get(key):
+                return self.idle[key].pop(), True
+        finally:
+            self.cond.release()
+        return self._connect(key), False
+
+    def _release(self, key, conn):
+        """
+        Give back the slot, and the connection if it can be reused.
+        """
+        self.cond.acquire()
+        try:
+            self.busy[key] -= 1
+            if conn is not None:
+                self.idle.setdefault(key, []).append(conn)
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+    def _connect(self, key):
+        scheme, netloc = key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout)
+        return httplib.HTTPConnection(netloc, timeout=self.timeout)
+
+
+class HTTPCache(object):
+    """
+    On disk cache of HTTP responses. Responses are fresh for a time that
+    depends on the url (see TTLS), stale responses are revalidated with
+    their ETag or Last-Modified headers, and the least recently used
+    responses are evicted when the cache grows over MAX_SIZE bytes.
+    """
+
+    MAX_SIZE = 20 * 1024 * 1024
+    DEFAULT_TTL = 3600
+    # (url part, time to live in seconds), the first match wins: track
+    # lists and licenses rarely change, album lists (popular, latest and
+    # search results) do
+    TTLS = [
+        ('/track/', 7 * 86400),
+        ('/license/', 7 * 86400),
+        ('/album/', 3600),
+    ]
+
+    def __init__(self, http, directory=None):
+        self.http = http
+        self.directory = directory or \
+            os.path.join(get_cache_dir(), 'api')
+        # bytes written since the last eviction scan
+        self.written = 0
+
+    def get(self, url):
+        """
+        Return the body of the given url from the cache if it is fresh,
+        otherwise request it (conditionally if it is in the cache). If the
+        server cannot be reached or fails, a stale response is returned if
+        any.
+        """
+        path = self._get_path(url)
+        entry = self._load(path)
+        now = time.time()
+        if entry is not None and 0 <= now - entry['time'] < self._get_ttl(url):
+            return entry['body']
+        headers = {}
+        if entry is not None and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry['last-modified']:
+            headers['If-Modified-Since'] = entry['last-modified']
+        try:
+            status, reason, hdrs, body = self.http.request(url, headers)
+        except urllib2.URLError, exc:
+            if entry is None:
+                raise
+            return entry['body']
+        if status >= 500 and entry is not None:
+            # server error, hopefully a temporary one
+            return entry['body']
+        if status == 304 and entry is not None:
+            entry['time'] = now
+        elif status >= 300:
+            raise urllib2.HTTPError(url, status, reason, hdrs, None)
+        else:
+            entry = {
+                'time': now,
+                'etag': hdrs.get('etag'),
+                'last-modified': hdrs.get('last-modified'),
+                'body': body,
+            }
+        if 'no-store' not in hdrs.get('cache-control', ''):
+            self._store(path, entry)
+        return entry['body']
+
+    def evict(self, max_size=None):
+        """
+        Remove the least recently used responses until the cache size is
+        lower than max_size (MAX_SIZE by default).
+        """
+        if max_size is None:
+            max_size = self.MAX_SIZE
+        self.written = 0
+        entries = []
+        total = 0
+        for root, dirs, files in os.walk(self.directory):
+            for f in files:
+                path = os.path.join(root, f)
+                try:
+                    st = os.stat(path)
+                except OSError, exc:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= max_size * 0.9:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError, exc:
+                pass
+
+    def _get_ttl(self, url):
+        for part, ttl in self.TTLS:
+            if part in url:
+                return ttl
+        return self.DEFAULT_TTL
+
+    def _get_path(self, url):
+        key = hashlib.sha1(url).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load(self, path):
+        try:
+            fh = open(path, 'rb')
+            try:
+                entry = pickle.load(fh)
+            finally:
+                fh.close()
+            # the mtime of entries is used as the LRU clock
+            os.utime(path, None)
+            return entry
+        except Exception, exc:
+            return None
+
+    def _store(self, path, entry):
+        """
+        Write the given entry atomically, failures are ignored.
+        """
+        tmp = '%s.%s.%s' % (path, os.getpid(), threading.currentThread().ident)
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path), 0700)
+            fh = open(tmp, 'wb')
+            try:
+                pickle.dump(entry, fh, pickle.HIGHEST_PROTOCOL)
+            finally:
+                fh.close()
+            os.rename(tmp, path)
+            self.written += os.path.getsize(path)
+        except Exception, exc:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            return
+        if self.written > self.MAX_SIZE / 10:
+            self.evict()
+
+
+class CoverCache(object):
+    """
+    Two level cache of album covers keyed by image url: the pixbufs of the
+    most recently used covers are kept in memory and every cover is stored
+    on disk as a freedesktop.org thumbnail, so that it is neither fetched
+    nor decoded again in the next sessions.
+    """
+
+    MAX_ITEMS = 200
+
+    def __init__(self, http, directory=None):
+        self.http = http
+        self.directory = directory or get_thumbnails_dir()
+        self.lock = threading.Lock()
+        self.pixbufs = {}
+        # urls of the pixbufs in memory, least recently used first
+        self.lru = []
+
+    def get(self, url):
+        """
+        Return the pixbuf of the given image url, from memory, from the
+        thumbnails directory or from the network. gobject.GError is raised
+        if the image cannot be decoded and urllib2.URLError if it cannot be
+        downloaded.
+        """
+        pb = self._get_pixbuf(url)
+        if pb is not None:
+            return pb
+        path = self.get_path(url)
+        try:
+            pb = gtk.gdk.pixbuf_new_from_file(path)
+        except gobject.GError, exc:
+            pb = None
+        if pb is None or pb.get_option('tEXt::Thumb::URI') != url:
+            pb = self._download(url)
+            self._save(pb, url, path)
+        self._add_pixbuf(url, pb)
+        return pb
+
+    def get_path(self, url):
+        """
+        Return the thumbnail path of the given url as defined by the
+        thumbnail specification (md5 of the uri).
+        """
+        return os.path.join(self.directory,
+                            '%s.png' % hashlib.md5(url).hexdigest())
+
+    def _get_pixbuf(self, url):
+        self.lock.acquire()
+        try:
+            pb = self.pixbufs.get(url)
+            if pb is not None:
+                self.lru.remove(url)
+                self.lru.append(url)
+            return pb
+        finally:
+            self.lock.release()
+
+    def _add_pixbuf(self, url, pb):
+        self.lock.acquire()
+        try:
+            if url in self.pixbufs:
+                self.lru.remove(url)
+            self.pixbufs[url] = pb
+            self.lru.append(url)
+            while len(self.lru) > self.MAX_ITEMS:
+                del self.pixbufs[self.lru.pop(0)]
+        finally:
+            self.lock.release()
+
+    def _download(self, url):
+        """
+        Decode the image while it is downloaded.
+        """
+        loader = gtk.gdk.PixbufLoader()
+        try:
+            self.http.get(url, callback=loader.write)
+        except:
+            # release the loader without hiding the download error
+            exc_info = sys.exc_info()
+            try:
+                loader.close()
+            except gobject.GError, exc:
+                pass
+            raise exc_info[0], exc_info[1], exc_info[2]
+        loader.close()
+        pb = loader.get_pixbuf()
+        if pb is None:
+            raise gobject.GError('%s is not an image' % url)
+        return pb
+
+    def _save(self, pb, url, path):
+        """
+        Write the thumbnail of the given url atomically with the
+        permissions required by the specification, failures are ignored.
+        """
+        tmp = '%s.%s.%s' % (path, os.getpid(), threading.currentThread().ident)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, 0700)
+            pb.save(tmp, 'png', {
+                'tEXt::Thumb::URI': url,
+                'tEXt::Software': 'Totem Jamendo plugin',
+            })
+            os.chmod(tmp, 0600)
+            os.rename(tmp, path)
+        except (gobject.GError, OSError), exc:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+
 class JamendoService(threading.Thread):
     """
     Class that requests the jamendo REST service.
@@ -660,6 +1092,11 @@ class JamendoService(threading.Thread):
     API_URL = 'http://api.jamendo.com/get2'
     AUDIO_FORMAT = 'ogg2'
     NUM_PER_PAGE = 10
+    MAX_WORKERS = 6
+    # shared by all the service threads so that connections are reused
+    http = HTTPClient()
+    cache = HTTPCache(http)
+    covers = CoverCache(http)
 
     def __init__(self, params, loop_cb, done_cb, error_cb):
         self.params = params
@@ -678,18 +1115,8 @@ class JamendoService(threading.Thread):
         try:
             self.lock.acquire()
             albums = json.loads(self._request(url))
-            ret = []
-            for i, album in enumerate(albums):
-                fname, headers = urllib.urlretrieve(album['image'])
-                album['image'] = fname
-                album['tracks'] = json.loads(self._request(
-                    '%s/id+name+duration+stream/track/json/?album_id=%s'\
-                    '&order=numalbum_asc' % (self.API_URL, album['id'])
-                ))
-                album['license'] = json.loads(self._request(
-                    '%s/name/license/json/album_license/?album_id=%s'\
-                    % (self.API_URL, album['id'])
-                ))
+            self._fetch_details(albums)
+            for album in self._fetch_albums(albums):
                 gobject.idle_add(self.loop_cb[0], self.loop_cb[1], album)
             gobject.idle_add(self.done_cb[0], self.done_cb[1], albums)
         except Exception, exc:
@@ -697,11 +1124,92 @@ class JamendoService(threading.Thread):
         finally:
             self.lock.release()
 
+    def _fetch_details(self, albums):
+        """
+        Fetch the tracks and licenses of all the given albums with one
+        request each, the results are grouped by album id.
+        """
+        if not albums:
+            return
+        # the get2 api accepts several values separated by spaces
+        ids = '+'.join([str(album['id']) for album in albums])
+        tracks = {}
+        for track in json.loads(self._request(
+            '%s/id+name+duration+stream+album_id/track/json/?album_id=%s'\
+            '&order=numalbum_asc&n=all' % (self.API_URL, ids)
+        )):
+            tracks.setdefault(str(track['album_id']), []).append(track)
+        licenses = {}
+        for license in json.loads(self._request(
+            '%s/name+album_id/license/json/album_license/?album_id=%s'\
+            '&n=all' % (self.API_URL, ids)
+        )):
+            licenses.setdefault(str(license['album_id']), []).append(
+                license['name'])
+        for album in albums:
+            album['tracks'] = tracks.get(str(album['id']), [])
+            album['license'] = licenses.get(str(album['id']), [])
+
+    def _fetch_albums(self, albums):
+        """
+        Fetch the covers of the given albums with at most MAX_WORKERS
+        concurrent threads and yield the albums in page order as soon as
+        they are complete. The first error is raised.
+        """
+        jobs = Queue.Queue()
+        for i in range(len(albums)):
+            jobs.put(i)
+        results = {}
+        cond = threading.Condition()
+        abort = threading.Event()
+        def worker():
+            while not abort.isSet():
+                try:
+                    i = jobs.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    self._fetch_album(albums[i])
+                    result = None
+                except Exception, exc:
+                    result = exc
+                cond.acquire()
+                try:
+                    results[i] = result
+                    cond.notify()
+                finally:
+                    cond.release()
+        for i in range(min(self.MAX_WORKERS, len(albums))):
+            t = threading.Thread(target=worker)
+            t.setDaemon(True)
+            t.start()
+        try:
+            for i, album in enumerate(albums):
+                cond.acquire()
+                try:
+                    while i not in results:
+                        cond.wait()
+                    exc = results.pop(i)
+                finally:
+                    cond.release()
+                if exc is not None:
+                    raise exc
+                yield album
+        finally:
+            # pending albums are not fetched after an error
+            abort.set()
+
+    def _fetch_album(self, album):
+        """
+        Replace the cover url of the given album by its pixbuf.
+        """
+        try:
+            album['image'] = self.covers.get(album['image'])
+        except (gobject.GError, urllib2.URLError), exc:
+            # do not fail for this, a dummy pixbuf is displayed for a cover
+            # that cannot be downloaded or decoded
+            album['image'] = None
+
     def _request(self, url):
-        opener = urllib2.build_opener()
-        opener.addheaders = [('User-agent', 'Totem Jamendo plugin')]
-        handle = opener.open(url)
-        data = handle.read()
-        handle.close()
-        return data
+        return self.cache.get(url)
 